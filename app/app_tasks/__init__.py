@@ -7,6 +7,9 @@ CELERY_TASK_LIST = [
     "app.app_tasks.tasks",
 ]
 
+# seconds between flushes of activity of users from Redis to the database
+LAST_ACTIVITY_FLUSH_INTERVAL = 60
+
 
 def create_celery_app(app=None) -> Celery:
     """
@@ -18,6 +21,12 @@ def create_celery_app(app=None) -> Celery:
         app.import_name, broker=config["broker_url"], include=CELERY_TASK_LIST
     )
     celery.conf.update(app.config)
+    celery.conf.beat_schedule = {
+        "flush-last-activity": {
+            "task": "app.app_tasks.tasks.flush_last_activity",
+            "schedule": LAST_ACTIVITY_FLUSH_INTERVAL,
+        },
+    }
 
     class ContextTask(Task):
         abstract = True
@@ -9,8 +9,23 @@ from flask_mail import Message
 
 from app import mail, db, r
 from app.app_tasks import create_celery_app
-from app.models import User, Investment
-from app.redis_client import create_notification, add_notification
+from app.handling_files import (
+    get_temp_path,
+    handle_csv_files,
+    handle_snapshot,
+    remove,
+    write_snapshot,
+)
+from app.models import User, Investment, Wall
+from app.production.masonry_works.data_treatment import get_snapshot
+from app.redis_client import (
+    create_notification,
+    add_notification,
+    delete_last_activities,
+    delete_last_activity,
+    get_last_activities,
+    update_import_progress,
+)
 
 celery = create_celery_app()
 
@@ -39,6 +54,63 @@ def archive_and_save(path: str, catalog: str, worker_id: int) -> None:
     add_notification(r, notification)
 
 
+@celery.task(bind=True)
+def import_files(
+    self, filenames: List, invest_id: int, model: str, worker_id: int
+) -> List:
+    job_id = self.request.id
+
+    def progress(rows: int, failures: int) -> None:
+        update_import_progress(r, job_id, rows=rows, failures=failures)
+
+    # files of the job are uploaded to temp folder named by id of the job
+    paths = [os.path.join(job_id, filename) for filename in filenames]
+    update_import_progress(r, job_id, status="running")
+    try:
+        if model == "snapshot":
+            messages = []
+            for path in paths:
+                messages += handle_snapshot(path, invest_id, Wall, progress=progress)
+        else:
+            messages = handle_csv_files(
+                paths, invest_id, model, Wall, progress=progress
+            )
+    except Exception as e:
+        db.session.rollback()
+        messages = [f'An error occurred: "{e}", while importing files.']
+        update_import_progress(r, job_id, status="failed", messages=messages)
+        notification = create_notification(
+            worker_id=worker_id,
+            n_type="import",
+            description=f"Import of {', '.join(filenames)} failed. {messages[0]}",
+        )
+        add_notification(r, notification)
+        raise
+    finally:
+        remove(os.path.join(get_temp_path(), job_id))
+    update_import_progress(r, job_id, status="finished", messages=messages)
+    notification = create_notification(
+        worker_id=worker_id,
+        n_type="import",
+        description=f"Import of {', '.join(filenames)} finished. {' '.join(messages)}",
+    )
+    add_notification(r, notification)
+    return messages
+
+
+@celery.task
+def export_snapshot(path: str, invest_id: int, worker_id: int) -> None:
+    filename = f"masonry_works_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.zip"
+    os.makedirs(path, exist_ok=True)
+    write_snapshot(get_snapshot(invest_id), os.path.join(path, filename))
+    notification = create_notification(
+        worker_id=worker_id,
+        n_type="archive",
+        description=f"You can download the file: {filename}",
+    )
+    add_notification(r, notification)
+
+
 @celery.task
 def send_email(
     subject: str, sender: str, recipients: List, text_body: str, html_body: str
@@ -53,13 +125,41 @@ def send_email(
 def delete_if_unused(username: str) -> None:
     user = User.query.filter_by(username=username).first()
     if user:
-        if user.last_activity + timedelta(seconds=300) < datetime.utcnow():
+        if user.get_last_activity() + timedelta(seconds=300) < datetime.utcnow():
             for investment in Investment.get_by_user_id(user.id):
                 db.session.delete(investment)
             db.session.delete(user)
             db.session.commit()
+            delete_last_activity(r, user.id)
         else:
-            delete_if_unused.apply_async(args=(user.id,), countdown=600)
+            delete_if_unused.apply_async(args=(username,), countdown=600)
+
+
+@celery.task
+def flush_last_activity() -> None:
+    """Writes activity of users recorded in Redis since the last flush to the
+    database in one batch. Activity recorded while flushing stays in Redis
+    until the next run."""
+
+    activities = get_last_activities(r)
+    if not activities:
+        return
+    user_ids = {
+        user_id
+        for user_id, in User.query.with_entities(User.id).filter(
+            User.id.in_(activities)
+        )
+    }
+    db.session.bulk_update_mappings(
+        User,
+        [
+            {"id": user_id, "last_activity": datetime.fromisoformat(timestamp)}
+            for user_id, timestamp in activities.items()
+            if user_id in user_ids
+        ],
+    )
+    db.session.commit()
+    delete_last_activities(r, activities)
 
 
 def get_fake_name() -> Union[str, None]:
@@ -84,5 +184,5 @@ def add_fake_name_to_buffer() -> None:
         if name:
             r.lpush(f"fake_names", name)
             break
-    else:   # no break
+    else:  # no break
         r.lpush(f"fake_names", f"Guest ({datetime.utcnow().isoformat()})")
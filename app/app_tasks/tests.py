@@ -1,2 +1,129 @@
-def test_delete_if_unused(app_and_db):
-    pass
+import os
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db, r
+from app.app_tasks.tasks import (
+    delete_if_unused,
+    export_snapshot,
+    flush_last_activity,
+    import_files,
+)
+from app.handling_files import get_temp_path
+from app.models import Investment, User, Wall, Worker
+from app.redis_client import (
+    create_import_progress,
+    drain_notifications,
+    get_import_progress,
+    get_last_activities,
+    get_last_activity,
+    record_last_activity,
+)
+
+
+def test_delete_if_unused(add_investment, mocker):
+    mocker.patch("app.app_tasks.tasks.delete_if_unused.apply_async")
+    user = User.query.filter_by(username="active_user").first()
+    user.last_activity = datetime.utcnow() - timedelta(hours=1)
+    db.session.commit()
+    user.update_last_activity()
+    delete_if_unused.run("active_user")
+    delete_if_unused.apply_async.assert_called_once_with(
+        args=("active_user",), countdown=600
+    )
+    record_last_activity(r, user.id, datetime.utcnow() - timedelta(hours=1))
+    delete_if_unused.run("active_user")
+    assert not User.query.filter_by(username="active_user").first()
+    assert not Investment.get_by_user_id(user.id)
+    assert get_last_activity(r, user.id) is None
+
+
+def test_flush_last_activity(active_user, unlogged_user):
+    user = User.query.filter_by(username="active_user").first()
+    timestamp = datetime.utcnow() + timedelta(minutes=1)
+    record_last_activity(r, user.id, timestamp)
+    record_last_activity(r, 100, timestamp)
+    flush_last_activity.run()
+    db.session.expire_all()
+    assert user.last_activity == timestamp
+    assert User.query.filter_by(username="unlogged_user").first().last_activity
+    assert get_last_activities(r) == {}
+    flush_last_activity.run()
+
+
+def test_import_files(add_walls, temp_csv):
+    investment = Investment.query.first()
+    worker = Worker.query.filter_by(position="admin").first()
+    columns = ["local_id", "wall_width", "wall_length", "floor_ord", "ceiling_ord"]
+    rows = [
+        dict(zip(columns, [8, 18, 2, 0, 3])),
+        dict(zip(columns, [9, 18, "x", 0, 3])),
+    ]
+    temp_csv(os.path.join("job", "import_walls.csv"), rows)
+    create_import_progress(r, "job", worker.id, "import_walls.csv")
+    import_files.push_request(id="job")
+    try:
+        messages = import_files.run(
+            ["import_walls.csv"], investment.id, "walls", worker.id
+        )
+    finally:
+        import_files.pop_request()
+    assert not os.path.exists(os.path.join(get_temp_path(), "job"))
+    assert messages == [
+        "Uploaded 1 items.",
+        "Items: [9] not added because they has the wrong format.",
+    ]
+    assert Wall.query.filter_by(local_id=8).first()
+    progress = get_import_progress(r, "job")
+    assert progress["status"] == "finished"
+    assert progress["rows"] == 2
+    assert progress["failures"] == 1
+    assert progress["messages"] == messages
+    [notification] = drain_notifications(r, worker.id)
+    assert notification["n_type"] == "import"
+    assert notification["description"].startswith(
+        "Import of import_walls.csv finished."
+    )
+
+
+def test_import_files_when_importer_fails(add_investment, temp_csv, mocker):
+    mocker.patch(
+        "app.app_tasks.tasks.handle_csv_files", side_effect=RuntimeError("broken")
+    )
+    investment = Investment.query.first()
+    worker = Worker.query.filter_by(position="admin").first()
+    temp_csv(os.path.join("job", "walls.csv"), [{"local_id": 1}])
+    create_import_progress(r, "job", worker.id, "walls.csv")
+    import_files.push_request(id="job")
+    try:
+        with pytest.raises(RuntimeError):
+            import_files.run(["walls.csv"], investment.id, "walls", worker.id)
+    finally:
+        import_files.pop_request()
+    assert not os.path.exists(os.path.join(get_temp_path(), "job"))
+    progress = get_import_progress(r, "job")
+    assert progress["status"] == "failed"
+    assert progress["messages"] == [
+        'An error occurred: "broken", while importing files.'
+    ]
+    notification = drain_notifications(r, worker.id)[0]
+    assert notification["n_type"] == "import"
+    assert "failed" in notification["description"]
+
+
+def test_export_snapshot(add_walls, tmp_path):
+    investment = Investment.query.first()
+    worker = Worker.query.filter_by(position="admin").first()
+    export_snapshot.run(str(tmp_path), investment.id, worker.id)
+    (path,) = tmp_path.iterdir()
+    assert path.suffix == ".zip"
+    with zipfile.ZipFile(path) as archive:
+        assert sorted(archive.namelist()) == [
+            "holes.parquet",
+            "processing.parquet",
+            "walls.parquet",
+        ]
+    [notification] = drain_notifications(r, worker.id)
+    assert notification["description"].endswith(path.name)
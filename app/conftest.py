@@ -3,12 +3,14 @@ import os
 from contextlib import contextmanager
 from typing import *
 
+import pandas as pd
 import pytest
 from flask import template_rendered
 from flask_login import AnonymousUserMixin
 
 from app import create_app, db, login, r
-from app.models import Wall, User, Investment, Worker, Task
+from app.handling_files import remove
+from app.models import Processing, Wall, User, Investment, Worker, Task
 from config import config, BASE_DIR
 
 contexts_required = pytest.mark.skipif(
@@ -64,6 +66,26 @@ def captured_templates(app_and_db):
         template_rendered.disconnect(record, app_and_db[0])
 
 
+@pytest.fixture
+def temp_csv(app_and_db) -> Callable:
+    """Writes rows to csv file in temp folder and returns its filename."""
+
+    temp_path = os.path.join(BASE_DIR, config["UPLOAD_FOLDER"], "temp")
+    os.makedirs(temp_path, exist_ok=True)
+    filenames = []
+
+    def write(filename: str, rows: List[Dict]) -> str:
+        file_path = os.path.join(temp_path, filename)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        pd.DataFrame(rows).to_csv(file_path, sep=";", index=False)
+        filenames.append(filename)
+        return filename
+
+    yield write
+    for filename in filenames:
+        remove(os.path.join(temp_path, filename))
+
+
 @pytest.fixture
 def wall_data(add_investment) -> Dict:
     investment = Investment.query.first()
@@ -96,6 +118,45 @@ def add_processing(app_and_db):
     Wall.add_processing(wall_id=1, year=2020, month="December", done=0.4)
 
 
+@pytest.fixture
+def add_walls(app_and_db, wall_data):
+    """Adds walls with holes and processing covering rounding edge cases."""
+
+    dimensions = [
+        (10.5, 3.1, 6.2),
+        (4.37, 0.0, 2.85),
+        (7.125, -1.35, 1.6),
+        (1.25, 0.1, 1.2),
+        (12.0, 2.95, 5.9),
+    ]
+    holes = [
+        [(1.2, 2.25, 2), (2.2, 2.0, 1)],
+        [(1.365, 1.0, 1), (0.9, 2.1, 3)],
+        [(1.75, 1.75, 2)],
+        [],
+        [(1.5, 2.0, 1), (1.2, 2.5, 4), (0.85, 0.95, 2)],
+    ]
+    processing = [[0.4], [0.3, 0.35], [0.6, 0.7], [], [0.25, 0.25, 0.5]]
+    for local_id, (wall_length, floor_ord, ceiling_ord) in enumerate(dimensions):
+        wall_data.update(
+            local_id=local_id + 1,
+            sector=["G", "F"][local_id % 2],
+            wall_length=wall_length,
+            floor_ord=floor_ord,
+            ceiling_ord=ceiling_ord,
+        )
+        Wall.add_wall(**wall_data)
+    for wall, wall_holes, wall_processing in zip(
+        Wall.query.order_by(Wall.id).all(), holes, processing
+    ):
+        for width, height, amount in wall_holes:
+            Wall.add_hole(wall.id, width=width, height=height, amount=amount)
+        for done in wall_processing:
+            wall.processing.append(Processing(year=2020, month="December", done=done))
+    db.session.commit()
+    Wall.refresh_metrics(wall.id for wall in Wall.query.all())
+
+
 @pytest.fixture
 def add_investment(app_and_db, active_user, unlogged_user):
     db = app_and_db[1]
@@ -0,0 +1,34 @@
+from decimal import Context, Decimal, Inexact, InvalidOperation
+from typing import *
+
+# Context of exact decimal arithmetic of dimensions and areas. Precision is far
+# above digits of products of dimensions, and an inexact result raises instead
+# of being rounded silently.
+EXACT = Context(prec=100, traps=[Inexact, InvalidOperation])
+
+
+def exact(value: Any) -> Decimal:
+    """Returns value as Decimal equal to its shortest decimal representation,
+    i.e. to Fraction(str(value)), without the cost of building a Fraction.
+    Raises ValueError for missing values and values which are not finite
+    numbers, like Fraction does."""
+
+    try:
+        number = EXACT.create_decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid number: {value!r}")
+    if not number.is_finite():
+        raise ValueError(f"Invalid number: {value!r}")
+    return number
+
+
+def add(a: Decimal, b: Decimal) -> Decimal:
+    return EXACT.add(a, b)
+
+
+def subtract(a: Decimal, b: Decimal) -> Decimal:
+    return EXACT.subtract(a, b)
+
+
+def multiply(a: Decimal, b: Decimal) -> Decimal:
+    return EXACT.multiply(a, b)
@@ -1,20 +1,47 @@
-import glob
 import os
 import shutil
 import time
+import zipfile
+from collections import deque
+from io import BytesIO
 from typing import *
 
 import pandas as pd
+from billiard import Pool
 from flask import g, request
 from flask_login import current_user
 
+from app.validators import (
+    convert_column,
+    validate_walls_frame,
+    validate_holes_frame,
+    validate_processing_frame,
+)
 from config import BASE_DIR, config
 
+# field of rows of csv files with local id of wall for each model
+LOCAL_ID_FIELDS = {
+    "walls": "local_id",
+    "holes": "wall_id",
+    "processing": "wall_id",
+}
 
-def allowed_file(filename: str) -> bool:
-    return (
-        "." in filename
-        and filename.rsplit(".", 1)[1].lower() in config["ALLOWED_EXTENSIONS"]
+# validators of whole chunks of csv files for each model
+FRAME_VALIDATORS = {
+    "walls": validate_walls_frame,
+    "holes": validate_holes_frame,
+    "processing": validate_processing_frame,
+}
+
+# tables of snapshot files in order of import
+SNAPSHOT_TABLES = ["walls", "holes", "processing"]
+# kinds of data imported by upload of files
+IMPORT_MODELS = SNAPSHOT_TABLES + ["snapshot"]
+
+
+def allowed_file(filename: str, extensions: Set = None) -> bool:
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in (
+        extensions or config["ALLOWED_EXTENSIONS"]
     )
 
 
@@ -30,32 +57,170 @@ def get_user_path(user_id: int, invest_id: int, path: str = "") -> str:
     )
 
 
-def read_csv_file(filename: str) -> List:
+def read_csv_frames(filename: str, chunksize: int = None) -> Iterator:
+    """Reads csv file in chunks of chunksize rows and yields them as DataFrames,
+    so memory used while reading does not grow with file size."""
+
     temp_path = get_temp_path()
     file_path = os.path.join(temp_path, filename)
-    return pd.read_csv(file_path, sep=";").to_dict(orient="records")
+    reader = pd.read_csv(
+        file_path, sep=";", chunksize=chunksize or config["CSV_CHUNK_SIZE"]
+    )
+    try:
+        yield from reader
+    finally:
+        reader.close()
 
 
-def read_csv_files(files_dir: str = "") -> Iterator:
-    temp_path = get_temp_path()
-    files_dir = os.path.join(temp_path, files_dir)
-    files_path = files_dir + "/*.csv"
-    files = glob.glob(files_path)
-    for file in files:
-        yield pd.read_csv(file, sep=";").to_dict(orient="records")
+def parse_csv_chunks(filename: str, model: str, chunksize: int = None) -> Iterator:
+    """Yields chunks of csv file as lists of (local id, data) for each row, where
+    data is validated for model or None when it has the wrong format. Local id
+    is None when the row has no valid local id."""
+
+    for frame in read_csv_frames(filename, chunksize):
+        yield parse_frame(frame, model)
+
+
+def parse_csv_chunks_in_pool(
+    pool: Pool, filename: str, model: str, window: int, chunksize: int = None
+) -> Iterator:
+    """Yields chunks of csv file parsed as by parse_csv_chunks, while processes
+    of pool parse up to window chunks ahead of the consumer. Chunks are read
+    lazily, so memory used does not grow with file size."""
 
+    pending = deque()
+    for frame in read_csv_frames(filename, chunksize):
+        pending.append(pool.apply_async(parse_frame, (frame, model)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def parse_frame(frame: pd.DataFrame, model: str) -> List:
+    """Parses chunk of csv file as a list of (local id, data) for each row,
+    checking all rows of the chunk at once with the frame validator of model."""
+
+    field = LOCAL_ID_FIELDS[model]
+    local_ids, bad = convert_column(frame, field, int)
+    local_ids = [
+        None if is_bad else local_id
+        for local_id, is_bad in zip(local_ids.tolist(), bad.tolist())
+    ]
+    frame = frame.assign(**{field: local_ids})
+    frame, reasons = FRAME_VALIDATORS[model](frame)
+    valid = [
+        bool(local_id) and is_valid
+        for local_id, is_valid in zip(local_ids, reasons.isna().tolist())
+    ]
+    records = iter(frame[valid].to_dict(orient="records"))
+    return [
+        (local_id, next(records) if is_valid else None)
+        for local_id, is_valid in zip(local_ids, valid)
+    ]
+
+
+def get_uploader(model: str, Wall) -> Union[Callable, None]:
+    return {
+        "walls": Wall.upload_walls,
+        "holes": Wall.upload_holes,
+        "processing": Wall.upload_processing,
+    }.get(model)
+
+
+def handle_csv_files(
+    filenames: List, invest_id: int, model: str, Wall, progress: Callable = None
+) -> List:
+    """Writes csv files to database one by one in order of filenames, while
+    chunks of each file are parsed and validated ahead in a pool of
+    IMPORT_PROCESSES processes. Billiard pool is used, as it can be started in
+    daemonic Celery workers. Progress is reported as totals of all files."""
 
-def handle_csv(filename: str, invest_id: int, model: str, Wall) -> List:
     messages = []
-    if model == "walls":
-        messages = Wall.upload_walls(invest_id, filename)
-    elif model == "holes":
-        messages = Wall.upload_holes(invest_id, filename)
-    elif model == "processing":
-        messages = Wall.upload_processing(invest_id, filename)
+    upload = get_uploader(model, Wall)
+    if not upload:
+        return messages
+    totals = {"rows": 0, "failures": 0}
+    file_totals = dict(totals)
+
+    def report(rows: int, failures: int) -> None:
+        file_totals.update(rows=rows, failures=failures)
+        if progress:
+            progress(totals["rows"] + rows, totals["failures"] + failures)
+
     temp_path = get_temp_path()
-    file_path = os.path.abspath(os.path.join(temp_path, filename))
-    remove(file_path)
+    processes = config["IMPORT_PROCESSES"]
+    pool = Pool(processes) if processes > 1 else None
+    try:
+        for filename in filenames:
+            if pool:
+                chunks = parse_csv_chunks_in_pool(pool, filename, model, 2 * processes)
+            else:
+                chunks = parse_csv_chunks(filename, model)
+            file_totals.update(rows=0, failures=0)
+            messages += upload(invest_id, filename, report, chunks)
+            totals["rows"] += file_totals["rows"]
+            totals["failures"] += file_totals["failures"]
+            remove(os.path.abspath(os.path.join(temp_path, filename)))
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+    return messages
+
+
+def write_snapshot(frames: Dict, file_path: str) -> None:
+    """Writes DataFrames as parquet files named by keys of frames to zip file."""
+
+    with zipfile.ZipFile(file_path, "w") as archive:
+        for name, frame in frames.items():
+            buffer = BytesIO()
+            frame.to_parquet(buffer, index=False)
+            archive.writestr(f"{name}.parquet", buffer.getvalue())
+
+
+def read_snapshot(filename: str) -> Dict:
+    temp_path = get_temp_path()
+    frames = {}
+    with zipfile.ZipFile(os.path.join(temp_path, filename)) as archive:
+        for name in archive.namelist():
+            table, extension = os.path.splitext(name)
+            if extension == ".parquet":
+                frames[table] = pd.read_parquet(BytesIO(archive.read(name)))
+    return frames
+
+
+def snapshot_chunks(frame: pd.DataFrame, model: str) -> Iterator:
+    """Yields parsed chunks of DataFrame with missing values as None."""
+
+    chunksize = config["CSV_CHUNK_SIZE"]
+    for i in range(0, len(frame), chunksize):
+        chunk = frame.iloc[i : i + chunksize].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        yield parse_frame(chunk, model)
+
+
+def handle_snapshot(
+    filename: str, invest_id: int, Wall, progress: Callable = None
+) -> List:
+    """Imports walls, holes and processing from snapshot zip file with parquet
+    files, in the same way as from csv files."""
+
+    messages = []
+    try:
+        frames = read_snapshot(filename)
+    except Exception as e:
+        messages.append(
+            'An error occurred: "{}", while loading file: "{}"'.format(e, filename)
+        )
+    else:
+        for model in SNAPSHOT_TABLES:
+            if model in frames:
+                upload = get_uploader(model, Wall)
+                chunks = snapshot_chunks(frames[model], model)
+                for message in upload(invest_id, filename, progress, chunks):
+                    messages.append("{}: {}".format(model.capitalize(), message))
+    remove(os.path.abspath(os.path.join(get_temp_path(), filename)))
     return messages
 
 
@@ -1,11 +1,11 @@
-from flask import render_template, redirect, url_for, g, jsonify, request
+from flask import render_template, redirect, url_for, g, jsonify, request, Response
 from flask_login import login_required, login_user, current_user
 
 from app import db, r
 from app.main import bp
 from app.main.populate_db import populate_db
 from app.models import User, Worker
-from app.redis_client import get_notification, populate_buffer
+from app.redis_client import drain_notifications, populate_buffer, stream_notifications
 
 
 @bp.before_app_first_request
@@ -34,8 +34,25 @@ def count_notifications() -> str:
 @login_required
 def notifications() -> str:
     worker_id = request.args.get("worker_id")
-    notification = get_notification(r, worker_id)
-    return jsonify([notification])
+    return jsonify(drain_notifications(r, worker_id) or [{}])
+
+
+@bp.route("/notifications/stream")
+@login_required
+def notifications_stream() -> Response:
+    """Streams notifications of the current worker as Server-Sent Events. The
+    connection stays open, so it is meant to be served by gevent workers."""
+
+    worker_id = g.current_worker.id
+    if not worker_id:
+        return Response(status=204)
+    # the stream does not use the database, so connection is not held by it
+    db.session.remove()
+    return Response(
+        stream_notifications(r, worker_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @bp.route("/")
@@ -1,7 +1,16 @@
+import json
+
 from flask import url_for
 
+from app import r
 from app.main.populate_db import get_or_create_user
-from app.models import User
+from app.models import User, Worker
+from app.redis_client import (
+    add_notification,
+    create_notification,
+    drain_notifications,
+    stream_notifications,
+)
 from app.app_tasks.tasks import delete_if_unused
 
 
@@ -46,3 +55,68 @@ class TestPopulateDB:
         delete_if_unused.apply_async.assert_called_once_with(
             args=("test_user",), countdown=600
         )
+
+
+class TestNotificationsStream:
+    @staticmethod
+    def test_stream_notifications(app_and_db):
+        add_notification(r, create_notification(1, "task", "queued"))
+        stream = stream_notifications(r, 1, keepalive=0.1)
+        assert json.loads(next(stream)[len("data: ") :]) == {
+            "worker_id": 1,
+            "n_type": "task",
+            "description": "queued",
+        }
+        assert next(stream) == ": keepalive\n\n"
+        add_notification(r, create_notification(1, "task", "published"))
+        assert "published" in next(stream)
+        assert next(stream) == ": keepalive\n\n"
+        assert not r.exists("notifications:1")
+        stream.close()
+
+    @staticmethod
+    def test_stream_notifications_to_every_stream(app_and_db):
+        streams = [stream_notifications(r, 1, keepalive=0.1) for _ in range(2)]
+        assert [next(stream) for stream in streams] == [": keepalive\n\n"] * 2
+        add_notification(r, create_notification(1, "task", "published"))
+        for stream in streams:
+            assert "published" in next(stream)
+        for stream in streams:
+            stream.close()
+
+    @staticmethod
+    def test_get(client, test_with_authenticated_user, add_investment):
+        worker = Worker.query.filter_by(position="admin").first()
+        add_notification(r, create_notification(worker.id, "task", "new task"))
+        response = client.get(url_for("main.notifications_stream"), buffered=False)
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+        assert b"new task" in next(response.response)
+        response.close()
+
+    @staticmethod
+    def test_get_without_worker(client, test_with_authenticated_user):
+        response = client.get(url_for("main.notifications_stream"))
+        assert response.status_code == 204
+
+
+class TestNotifications:
+    @staticmethod
+    def test_drain_notifications(app_and_db, mocker):
+        mocker.patch("app.redis_client.NOTIFICATIONS_LIMIT", 3)
+        for i in range(5):
+            add_notification(r, create_notification(1, "task", str(i)))
+        assert r.ttl("notifications:1") > 0
+        notifications = drain_notifications(r, 1)
+        assert [n["description"] for n in notifications] == ["2", "3", "4"]
+        assert drain_notifications(r, 1) == []
+
+    @staticmethod
+    def test_get(client, test_with_authenticated_user, add_investment):
+        url = url_for("main.notifications", worker_id=1)
+        assert client.get(url).get_json() == [{}]
+        add_notification(r, create_notification(1, "task", "first"))
+        add_notification(r, create_notification(1, "task", "second"))
+        notifications = client.get(url).get_json()
+        assert [n["description"] for n in notifications] == ["first", "second"]
+        assert client.get(url).get_json() == [{}]
@@ -1,23 +1,38 @@
+from collections import defaultdict
 from datetime import datetime, timedelta
-from fractions import Fraction as frac
+from decimal import Decimal
 from typing import *
 
 from flask_login import UserMixin
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import BigInteger, cast, event, func, inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
-from wtforms.validators import ValidationError
 
-from app import db, login
-from app.handling_files import read_csv_file
+from app import db, login, r
+from app.decimals import exact, multiply, subtract
+from app.handling_files import parse_csv_chunks
+from app.redis_client import (
+    bump_data_versions,
+    cache_unseen_tasks,
+    delete_cached_categories,
+    delete_cached_reports,
+    get_last_activity,
+    get_unseen_tasks,
+    record_last_activity,
+    reset_unseen_tasks,
+)
 from app.validators import (
-    check_field_exists,
-    validate_walls,
-    validate_holes,
-    validate_processing,
+    limit_done,
     validate_done_attr_while_adding,
     validate_done_attr_while_editing,
 )
 
+# Number of walls recomputed at once by Wall.refresh_metrics.
+METRICS_CHUNK_SIZE = 500
+
 
 class User(UserMixin, db.Model):
     __tablename__ = "users"
@@ -56,7 +71,7 @@ class User(UserMixin, db.Model):
 
     @classmethod
     def get_investments(cls, user_id: int) -> List:
-        """ Returns list of investments which the user is the worker in it. """
+        """Returns list of investments which the user is the worker in it."""
 
         return (
             Investment.query.join(Worker, Worker.investment_id == Investment.id)
@@ -82,7 +97,7 @@ class User(UserMixin, db.Model):
 
     @staticmethod
     def get_workers(user_id: int) -> List:
-        """ Returns list of workers, which the user is. """
+        """Returns list of workers, which the user is."""
 
         return Worker.query.filter_by(user_id=user_id).all()
 
@@ -97,8 +112,13 @@ class User(UserMixin, db.Model):
         return Investment()
 
     def update_last_activity(self):
-        self.last_activity = datetime.utcnow()
-        db.session.commit()
+        """Records activity in Redis only, the column is updated in batches by
+        the flush_last_activity task, so requests do not write to users."""
+
+        record_last_activity(r, self.id, datetime.utcnow())
+
+    def get_last_activity(self) -> datetime:
+        return get_last_activity(r, self.id) or self.last_activity
 
     def __repr__(self) -> str:
         return "<User(username=%s)>" % (self.username,)
@@ -174,12 +194,16 @@ class Worker(db.Model):
     def update_last_activity(self, attr: str) -> None:
         setattr(self, attr, datetime.utcnow())
         db.session.commit()
+        if attr == "last_time_tasks_displayed":
+            reset_unseen_tasks(r, self.id)
 
     def get_new_tasks(self) -> List:
         if self.last_time_tasks_displayed:
             return (
-                self.tasks_to_execution.filter(
-                    Task.created_at > self.last_time_tasks_displayed
+                Task.load_workers(
+                    self.tasks_to_execution.filter(
+                        Task.created_at > self.last_time_tasks_displayed
+                    )
                 )
                 .order_by(Task.created_at)
                 .all()
@@ -189,9 +213,25 @@ class Worker(db.Model):
     def get_new_messages(self) -> List:
         pass
 
+    def count_new_tasks(self) -> int:
+        """Returns number of new tasks of the worker, which is kept in Redis and
+        counted in the database only when it is not cached."""
+
+        if not self.id:
+            return 0
+        count = get_unseen_tasks(r, self.id)
+        if count is None:
+            count = 0
+            if self.last_time_tasks_displayed:
+                count = self.tasks_to_execution.filter(
+                    Task.created_at > self.last_time_tasks_displayed
+                ).count()
+            cache_unseen_tasks(r, self.id, count)
+        return count
+
     def count_unseen_notifications(self, n_type: str) -> int:
         if n_type == "tasks":
-            return len(self.get_new_tasks())
+            return self.count_new_tasks()
         elif n_type == "messages":
             return len(self.get_new_messages())
         return 0
@@ -270,25 +310,34 @@ class Task(db.Model):
         db.Integer, db.ForeignKey("investments.id", ondelete="CASCADE")
     )
 
-    @classmethod
-    def get_in_progress(cls, invest_id: int) -> List:
-        return (
-            Task.query.filter_by(investment_id=invest_id)
-            .filter(cls.progress != 100)
-            .order_by(Task.deadline)
-            .order_by(Task.priority.desc())
-            .all()
+    @staticmethod
+    def load_workers(query: BaseQuery) -> BaseQuery:
+        """Loads orderers and executors of tasks with their users in the same query."""
+
+        return query.options(
+            joinedload(Task.orderer).joinedload(Worker.users),
+            joinedload(Task.executor).joinedload(Worker.users),
         )
 
     @classmethod
-    def get_realized(cls, invest_id: int) -> List:
-        return (
-            Task.query.filter_by(investment_id=invest_id)
-            .filter(cls.progress == 100)
-            .order_by(Task.deadline)
-            .order_by(Task.priority.desc())
+    def get_board(cls, **filters) -> Tuple[List, List]:
+        """Returns tasks filtered by filters, e.g. investment_id or executor_id,
+        split into tasks in progress and realized ones, both ordered by deadline
+        and priority. Tasks are fetched in one query with their workers. Nothing
+        is returned when a filter is None, e.g. for worker who is not saved."""
+
+        if None in filters.values():
+            return [], []
+        tasks = (
+            cls.load_workers(cls.query.filter_by(**filters))
+            .order_by(cls.deadline, cls.priority.desc())
             .all()
         )
+        in_progress = [
+            task for task in tasks if task.progress is not None and task.progress != 100
+        ]
+        realized = [task for task in tasks if task.progress == 100]
+        return in_progress, realized
 
     def __repr__(self) -> str:
         return "<Task(description=%s)>" % (self.description,)
@@ -303,6 +352,8 @@ class Hole(db.Model):
     amount = db.Column(db.Integer)
     wall_id = db.Column(db.Integer, db.ForeignKey("walls.id", ondelete="CASCADE"))
 
+    CSV_FIELDS = ["width", "height", "amount"]
+
     @hybrid_property
     def area(self):
         return round(float(self.__compute_area()), 2)
@@ -315,12 +366,12 @@ class Hole(db.Model):
     def below_3m2(self):
         return self.__compute_below_3m2()
 
-    def __compute_area(self) -> frac:
-        return frac(str(self.width)) * frac(str(self.height))
+    def __compute_area(self) -> Decimal:
+        return multiply(exact(self.width), exact(self.height))
 
-    def __compute_total_area(self) -> frac:
+    def __compute_total_area(self) -> Decimal:
         area = self.__compute_area()
-        return area * frac(str(self.amount))
+        return multiply(area, exact(self.amount))
 
     def __compute_below_3m2(self) -> bool:
         return True if self.area < 3 else False
@@ -354,9 +405,9 @@ class Processing(db.Model):
 
     @done.setter
     def done(self, value):
-        if frac(str(value)) < frac("0"):
+        if exact(value) < 0:
             raise ValueError("Value: done cannot be less then 1!")
-        if frac(str(value)) > frac("1"):
+        if exact(value) > 1:
             raise ValueError("Value: done cannot be greater then 1!")
         self._done = value
 
@@ -405,54 +456,211 @@ class Wall(db.Model):
         db.Integer, db.ForeignKey("investments.id", ondelete="CASCADE")
     )
 
+    CSV_FIELDS = [
+        "local_id",
+        "sector",
+        "level",
+        "localization",
+        "brick_type",
+        "wall_width",
+        "wall_length",
+        "floor_ord",
+        "ceiling_ord",
+    ]
+
+    _wall_height = db.Column(db.Float(precision=2), index=True)
+    _gross_wall_area = db.Column(db.Float(precision=2), index=True)
+    _wall_area_to_survey = db.Column(db.Float(precision=2), index=True)
+    _wall_area_to_sale = db.Column(db.Float(precision=2), index=True)
+    _left_to_sale = db.Column(db.Float(precision=2), index=True)
+
     @hybrid_property
     def wall_height(self):
-        return round(float(self.__compute_wall_height()), 2)
+        if self._wall_height is None:
+            return round(float(self.__compute_wall_height()), 2)
+        return self._wall_height
+
+    @wall_height.expression
+    def wall_height(cls):
+        return cls._wall_height
 
     @hybrid_property
     def gross_wall_area(self):
-        return round(float(self.__compute_gross_wall_area()), 2)
+        if self._gross_wall_area is None:
+            return round(float(self.__compute_gross_wall_area()), 2)
+        return self._gross_wall_area
+
+    @gross_wall_area.expression
+    def gross_wall_area(cls):
+        return cls._gross_wall_area
 
     @hybrid_property
     def wall_area_to_survey(self):
-        return round(float(self.__compute_wall_area_to_survey()), 2)
+        if self._wall_area_to_survey is None:
+            return round(float(self.__compute_wall_area_to_survey()), 2)
+        return self._wall_area_to_survey
+
+    @wall_area_to_survey.expression
+    def wall_area_to_survey(cls):
+        return cls._wall_area_to_survey
 
     @hybrid_property
     def wall_area_to_sale(self):
-        return round(float(self.__compute_wall_area_to_sale()), 2)
+        if self._wall_area_to_sale is None:
+            return round(float(self.__compute_wall_area_to_sale()), 2)
+        return self._wall_area_to_sale
+
+    @wall_area_to_sale.expression
+    def wall_area_to_sale(cls):
+        return cls._wall_area_to_sale
 
     @hybrid_property
     def left_to_sale(self):
-        return round(float(self.__compute_left_to_sale()), 2)
+        if self._left_to_sale is None:
+            return round(float(self.__compute_left_to_sale()), 2)
+        return self._left_to_sale
+
+    @left_to_sale.expression
+    def left_to_sale(cls):
+        return cls._left_to_sale
+
+    def update_metrics(self, prefetched: bool = False, rollup: bool = True) -> None:
+        """Stores computed areas of the wall in its columns. Areas which cannot be
+        computed because of missing dimensions are stored as None. Holes and
+        processing are queried again unless they have been just prefetched.
+        The change of areas is applied to the rollup of the investment unless
+        rollup is False, e.g. when the whole rollup is rebuilt afterwards."""
+
+        if not prefetched:
+            self.clear_prefetched()
+        if rollup and inspect(self).persistent:
+            WallRollup.apply(
+                self.investment_id, *self.get_rollup_entry(committed=True), sign=-1
+            )
+        self._wall_height = self.__round_or_none(self.__compute_wall_height)
+        self._gross_wall_area = self.__round_or_none(self.__compute_gross_wall_area)
+        self._wall_area_to_survey = self.__round_or_none(
+            self.__compute_wall_area_to_survey
+        )
+        self._wall_area_to_sale = self.__round_or_none(self.__compute_wall_area_to_sale)
+        self._left_to_sale = self.__round_or_none(self.__compute_left_to_sale)
+        if rollup:
+            WallRollup.apply(self.investment_id, *self.get_rollup_entry())
+
+    @staticmethod
+    def __round_or_none(compute: Callable) -> Optional[float]:
+        try:
+            return round(float(compute()), 2)
+        except (TypeError, ValueError):
+            return None
+
+    def get_rollup_entry(self, committed: bool = False) -> Tuple[Dict, Dict]:
+        """Returns rollup dimensions of the wall and its stored areas in rollup units.
+        With committed, dimensions are taken as they were before pending changes."""
+
+        key = {}
+        for dimension in WallRollup.DIMENSIONS:
+            history = inspect(self).attrs[dimension].history
+            if committed and history.deleted:
+                key[dimension] = history.deleted[0]
+            else:
+                key[dimension] = getattr(self, dimension)
+        return key, WallRollup.get_values(self)
 
-    def __compute_wall_height(self) -> frac:
-        return frac(str(self.ceiling_ord)) - frac(str(self.floor_ord))
+    @classmethod
+    def refresh_metrics(cls, wall_ids: Iterable) -> None:
+        """Recomputes stored areas of walls in chunks, each in one vectorized
+        pass written with a bulk update, and rebuilds rollups of affected
+        investments."""
+
+        from app.production.masonry_works.data_treatment import SurveyEngine
+
+        wall_ids = list(wall_ids)
+        invest_ids = set()
+        for i in range(0, len(wall_ids), METRICS_CHUNK_SIZE):
+            items = cls.query.filter(cls.id.in_(wall_ids[i : i + METRICS_CHUNK_SIZE]))
+            invest_ids.update(
+                invest_id
+                for invest_id, in items.with_entities(cls.investment_id).distinct()
+            )
+            mappings = SurveyEngine.from_query(items).to_mappings()
+            db.session.bulk_update_mappings(cls, mappings)
+        for invest_id in invest_ids:
+            WallRollup.rebuild(invest_id)
+        db.session.commit()
 
-    def __compute_gross_wall_area(self) -> frac:
+    def __compute_wall_height(self) -> Decimal:
+        return subtract(exact(self.ceiling_ord), exact(self.floor_ord))
+
+    def __compute_gross_wall_area(self) -> Decimal:
         wall_height = self.__compute_wall_height()
-        return frac(str(self.wall_length)) * wall_height
+        return multiply(exact(self.wall_length), wall_height)
 
-    def __compute_wall_area_to_survey(self) -> frac:
+    def __compute_wall_area_to_survey(self) -> Decimal:
         wall_area_to_survey = self.__compute_gross_wall_area()
-        for hole in self.holes:
-            wall_area_to_survey -= frac(str(hole.total_area))
+        for hole in self.get_holes():
+            wall_area_to_survey = subtract(wall_area_to_survey, exact(hole.total_area))
         return wall_area_to_survey
 
-    def __compute_wall_area_to_sale(self) -> frac:
+    def __compute_wall_area_to_sale(self) -> Decimal:
         wall_area_to_sale = self.__compute_gross_wall_area()
-        for hole in self.holes:
+        for hole in self.get_holes():
             if not hole.below_3m2:
-                wall_area_to_sale -= frac(str(hole.total_area)) - frac(str(hole.amount))
+                wall_area_to_sale = subtract(
+                    wall_area_to_sale,
+                    subtract(exact(hole.total_area), exact(hole.amount)),
+                )
         return wall_area_to_sale
 
-    def __compute_left_to_sale(self) -> frac:
-        left_to_sale = frac("1")
-        for item in self.processing.order_by(Processing.id):
-            if left_to_sale < frac(str(item.done)):
-                return frac("0.0")
-            left_to_sale -= frac(str(item.done))
+    def __compute_left_to_sale(self) -> Decimal:
+        left_to_sale = Decimal(1)
+        for item in self.get_processing():
+            done = exact(item.done)
+            if left_to_sale < done:
+                return Decimal(0)
+            left_to_sale = subtract(left_to_sale, done)
         return left_to_sale
 
+    def get_holes(self) -> List:
+        """Returns holes attached by prefetch or queries them otherwise."""
+
+        holes = getattr(self, "_prefetched_holes", None)
+        if holes is None:
+            return self.holes.order_by(Hole.id).all()
+        return holes
+
+    def get_processing(self) -> List:
+        """Returns processing attached by prefetch or queries it otherwise."""
+
+        processing = getattr(self, "_prefetched_processing", None)
+        if processing is None:
+            return self.processing.order_by(Processing.id).all()
+        return processing
+
+    @classmethod
+    def prefetch(cls, items: BaseQuery) -> List:
+        """Returns walls selected by query with holes and processing loaded
+        in two queries, so computed properties do not query them per wall."""
+
+        walls = items.all()
+        ids = [wall.id for wall in walls]
+        holes = defaultdict(list)
+        for hole in Hole.query.filter(Hole.wall_id.in_(ids)).order_by(Hole.id):
+            holes[hole.wall_id].append(hole)
+        processing = defaultdict(list)
+        for item in Processing.query.filter(Processing.wall_id.in_(ids)).order_by(
+            Processing.id
+        ):
+            processing[item.wall_id].append(item)
+        for wall in walls:
+            wall._prefetched_holes = holes[wall.id]
+            wall._prefetched_processing = processing[wall.id]
+        return walls
+
+    def clear_prefetched(self) -> None:
+        self.__dict__.pop("_prefetched_holes", None)
+        self.__dict__.pop("_prefetched_processing", None)
+
     @classmethod
     def create_item(cls, invest_id: int, **kwargs) -> db.Model:
         return cls(
@@ -472,6 +680,7 @@ class Wall(db.Model):
     def add_wall(cls, invest_id: int, **kwargs) -> None:
         wall = cls.create_item(invest_id, **kwargs)
         db.session.add(wall)
+        wall.update_metrics()
         db.session.commit()
 
     @classmethod
@@ -480,6 +689,7 @@ class Wall(db.Model):
         if wall:
             hole = Hole.create_item(**kwargs)
             wall.holes.append(hole)
+            wall.update_metrics()
             db.session.add(wall)
             db.session.commit()
 
@@ -490,6 +700,7 @@ class Wall(db.Model):
             kwargs = validate_done_attr_while_adding(wall, kwargs)
             processing = Processing.create_item(**kwargs)
             wall.processing.append(processing)
+            wall.update_metrics()
             db.session.add(wall)
             db.session.commit()
 
@@ -498,6 +709,7 @@ class Wall(db.Model):
         wall = cls.query.filter_by(id=wall_id).first()
         if wall:
             cls.update_item(wall, **kwargs)
+            wall.update_metrics()
             db.session.add(wall)
             db.session.commit()
 
@@ -512,6 +724,7 @@ class Wall(db.Model):
             hole = wall.holes.filter_by(id=model_id).first()
             if hole:
                 cls.update_item(hole, **kwargs)
+                wall.update_metrics()
                 db.session.add(wall)
                 db.session.commit()
 
@@ -527,6 +740,7 @@ class Wall(db.Model):
             if processing:
                 kwargs = validate_done_attr_while_editing(wall, processing, kwargs)
                 cls.update_item(processing, **kwargs)
+                wall.update_metrics()
                 db.session.add(wall)
                 db.session.commit()
 
@@ -539,17 +753,34 @@ class Wall(db.Model):
 
     @classmethod
     def delete_wall(cls, wall_id: int) -> None:
+        wall = cls.query.filter_by(id=wall_id).first()
+        if wall:
+            WallRollup.apply(wall.investment_id, *wall.get_rollup_entry(), sign=-1)
         cls.query.filter_by(id=wall_id).delete()
         db.session.commit()
 
-    @staticmethod
-    def delete_hole(model_id: int) -> None:
+    @classmethod
+    def delete_hole(cls, model_id: int) -> None:
+        wall = (
+            cls.query.join(Hole, Hole.wall_id == cls.id)
+            .filter(Hole.id == model_id)
+            .first()
+        )
         Hole.query.filter_by(id=model_id).delete()
+        if wall:
+            wall.update_metrics()
         db.session.commit()
 
-    @staticmethod
-    def delete_processing(model_id: int) -> None:
+    @classmethod
+    def delete_processing(cls, model_id: int) -> None:
+        wall = (
+            cls.query.join(Processing, Processing.wall_id == cls.id)
+            .filter(Processing.id == model_id)
+            .first()
+        )
         Processing.query.filter_by(id=model_id).delete()
+        if wall:
+            wall.update_metrics()
         db.session.commit()
 
     @staticmethod
@@ -557,142 +788,269 @@ class Wall(db.Model):
         return "." in filename and filename.rsplit(".", 1)[1].lower() == "csv"
 
     @classmethod
-    def upload_walls(cls, invest_id: int, filename: str) -> List:
+    def upload_walls(
+        cls,
+        invest_id: int,
+        filename: str,
+        progress: Callable = None,
+        chunks: Iterable = None,
+    ) -> List:
         success = 0
         failures = []
-        if not cls.check_if_csv(filename):
+        rows_read = 0
+        wall_ids = set()
+        if chunks is None and not cls.check_if_csv(filename):
             return ["Wrong file format. File must be in csv format."]
+        existing = dict(
+            cls.get_all_items(invest_id).with_entities(cls.local_id, cls.id)
+        )
         try:
-            file = read_csv_file(filename)
+            if chunks is None:
+                chunks = parse_csv_chunks(filename, "walls")
+            for chunk in chunks:
+                rows_read += len(chunk)
+                rows = []
+                for local_id, data in chunk:
+                    if local_id:
+                        if data is None:
+                            failures.append(local_id)
+                        else:
+                            rows.append(data)
+                saved, save_failures = cls.save_walls(invest_id, existing, rows)
+                success += saved
+                failures += save_failures
+                if progress:
+                    progress(rows_read, len(failures))
+                for data in rows:
+                    if data["local_id"] in existing:
+                        wall_ids.add(existing[data["local_id"]])
         except Exception as e:
             return [
                 'An error occurred: "{}", while loading file: "{}"'.format(e, filename)
             ]
-        else:
-            for data in file:
-                local_id = check_field_exists(data, "local_id")
-                if local_id:
-                    try:
-                        data = validate_walls(data)
-                    except ValidationError:
-                        failures.append(local_id)
-                    else:
-                        wall = (
-                            Wall.get_all_items(invest_id)
-                            .filter_by(local_id=local_id)
-                            .first()
-                        )
-                        if wall:
-                            wall = Wall.update_item(wall, **data)
-                        else:
-                            wall = Wall.create_item(invest_id, **data)
-                        db.session.add(wall)
-                        try:
-                            db.session.commit()
-                        except Exception:
-                            db.session.rollback()
-                            failures.append(local_id)
-                        else:
-                            success += 1
-            return cls.create_upload_messages(success, failures)
+        finally:
+            cls.refresh_metrics(wall_ids)
+        return cls.create_upload_messages(success, failures)
 
     @classmethod
-    def upload_holes(cls, invest_id: int, filename: str) -> List:
+    def save_walls(cls, invest_id: int, existing: Dict, rows: List) -> Tuple[int, List]:
+        """Inserts new walls and updates existing ones matched by local_id with
+        batched statements in one transaction. Existing maps local ids to ids of
+        walls of investment and is updated with inserted walls. When the batch
+        fails, rows are saved one by one to report the failing ones. Returns
+        number of saved rows and local ids of failed rows."""
+
+        inserts = {}
+        updates = {}
+        for data in rows:
+            mapping = {field: data[field] for field in cls.CSV_FIELDS if field in data}
+            wall_id = existing.get(data["local_id"])
+            if wall_id:
+                updates.setdefault(wall_id, {"id": wall_id}).update(mapping)
+            else:
+                inserts.setdefault(
+                    data["local_id"], {"investment_id": invest_id}
+                ).update(mapping)
+        try:
+            db.session.bulk_insert_mappings(cls, list(inserts.values()))
+            db.session.bulk_update_mappings(cls, list(updates.values()))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            return cls.__save_walls_one_by_one(invest_id, existing, rows)
+        if inserts:
+            existing.update(
+                cls.get_all_items(invest_id)
+                .filter(cls.local_id.in_(inserts))
+                .with_entities(cls.local_id, cls.id)
+            )
+        return len(rows), []
+
+    @classmethod
+    def __save_walls_one_by_one(
+        cls, invest_id: int, existing: Dict, rows: List
+    ) -> Tuple[int, List]:
+        success = 0
+        failures = []
+        for data in rows:
+            local_id = data["local_id"]
+            if local_id in existing:
+                wall = cls.update_item(cls.query.get(existing[local_id]), **data)
+            else:
+                wall = cls.create_item(invest_id, **data)
+            db.session.add(wall)
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                failures.append(local_id)
+            else:
+                success += 1
+                existing[local_id] = wall.id
+        return success, failures
+
+    @classmethod
+    def upload_holes(
+        cls,
+        invest_id: int,
+        filename: str,
+        progress: Callable = None,
+        chunks: Iterable = None,
+    ) -> List:
         success = 0
         failures = []
         no_wall = []
-        wall_ids = []
-        if not cls.check_if_csv(filename):
+        rows_read = 0
+        wall_ids = set()
+        if chunks is None and not cls.check_if_csv(filename):
             return ["Wrong file format. File must be in csv format."]
+        walls = dict(cls.get_all_items(invest_id).with_entities(cls.local_id, cls.id))
         try:
-            file = read_csv_file(filename)
+            if chunks is None:
+                chunks = parse_csv_chunks(filename, "holes")
+            for chunk in chunks:
+                rows_read += len(chunk)
+                new_wall_ids = set()
+                rows = []
+                for wall_local_id, data in chunk:
+                    if wall_local_id:
+                        wall_id = walls.get(wall_local_id)
+                        if wall_id:
+                            # all holes of walls from csv are replaced by uploaded ones
+                            if wall_id not in wall_ids:
+                                new_wall_ids.add(wall_id)
+                                wall_ids.add(wall_id)
+                            if data is None:
+                                failures.append(wall_local_id)
+                            else:
+                                hole = {field: data[field] for field in Hole.CSV_FIELDS}
+                                rows.append(
+                                    (wall_local_id, dict(hole, wall_id=wall_id))
+                                )
+                        else:
+                            no_wall.append(wall_local_id)
+                saved, save_failures = cls.replace_items(Hole, new_wall_ids, rows)
+                success += saved
+                failures += save_failures
+                if progress:
+                    progress(rows_read, len(failures) + len(no_wall))
         except Exception as e:
             return [
                 'An error occurred: "{}", while loading file: "{}"'.format(e, filename)
             ]
-        else:
-            for data in file:
-                wall_local_id = check_field_exists(data, "wall_id")
-                if wall_local_id:
-                    wall = (
-                        Wall.get_all_items(invest_id)
-                        .filter_by(local_id=wall_local_id)
-                        .first()
-                    )
-                    if wall:
-                        # deleting all holes with particular wall_id before uploading from csv
-                        if wall.id not in wall_ids:
-                            Hole.query.filter_by(wall_id=wall.id).delete()
-                            wall_ids.append(wall.id)
-                        try:
-                            data = validate_holes(data)
-                        except ValidationError:
-                            failures.append(wall_local_id)
-                        else:
-                            hole = Hole.create_item(**data)
-                            wall.holes.append(hole)
-                            db.session.add(wall)
-                            try:
-                                db.session.commit()
-                            except Exception:
-                                db.session.rollback()
-                                failures.append(wall_local_id)
-                            else:
-                                success += 1
-                    else:
-                        no_wall.append(wall_local_id)
-            return cls.create_upload_messages(success, failures, no_wall)
+        finally:
+            cls.refresh_metrics(wall_ids)
+        return cls.create_upload_messages(success, failures, no_wall)
+
+    @classmethod
+    def replace_items(
+        cls, model: db.Model, wall_ids: Iterable, rows: List
+    ) -> Tuple[int, List]:
+        """Deletes holes or processing of walls and inserts rows of (wall local
+        id, item data) using one DELETE and one batched INSERT in one
+        transaction. When the batch fails, items are saved one by one to report
+        the failing ones. Returns number of saved items and wall local ids of
+        failed items."""
+
+        wall_ids = list(wall_ids)
+        try:
+            model.query.filter(model.wall_id.in_(wall_ids)).delete(
+                synchronize_session=False
+            )
+            db.session.bulk_insert_mappings(model, [data for _, data in rows])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            return cls.__replace_items_one_by_one(model, wall_ids, rows)
+        return len(rows), []
+
+    @staticmethod
+    def __replace_items_one_by_one(
+        model: db.Model, wall_ids: List, rows: List
+    ) -> Tuple[int, List]:
+        success = 0
+        failures = []
+        model.query.filter(model.wall_id.in_(wall_ids)).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        for wall_local_id, data in rows:
+            db.session.add(model(**data))
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                failures.append(wall_local_id)
+            else:
+                success += 1
+        return success, failures
 
     @classmethod
-    def upload_processing(cls, invest_id: int, filename: str) -> List:
+    def upload_processing(
+        cls,
+        invest_id: int,
+        filename: str,
+        progress: Callable = None,
+        chunks: Iterable = None,
+    ) -> List:
         success = 0
         failures = []
         no_wall = []
         no_left = []
-        wall_ids = []
-        if not cls.check_if_csv(filename):
+        rows_read = 0
+        left_to_sale = {}
+        if chunks is None and not cls.check_if_csv(filename):
             return ["Wrong file format. File must be in csv format."]
+        walls = dict(cls.get_all_items(invest_id).with_entities(cls.local_id, cls.id))
         try:
-            file = read_csv_file(filename)
+            if chunks is None:
+                chunks = parse_csv_chunks(filename, "processing")
+            for chunk in chunks:
+                rows_read += len(chunk)
+                new_wall_ids = set()
+                rows = []
+                for wall_local_id, data in chunk:
+                    if wall_local_id:
+                        wall_id = walls.get(wall_local_id)
+                        if wall_id:
+                            # all processing of walls from csv is replaced by uploaded one,
+                            # so left_to_sale of wall is tracked from 1 as rows are added
+                            if wall_id not in left_to_sale:
+                                new_wall_ids.add(wall_id)
+                                left_to_sale[wall_id] = Decimal(1)
+                            left = left_to_sale[wall_id]
+                            if round(float(left), 2) == 0:
+                                no_left.append(wall_local_id)
+                                continue
+                            if data is None:
+                                failures.append(wall_local_id)
+                            else:
+                                data = limit_done(data, round(float(left), 2))
+                                done = exact(data["done"])
+                                left_to_sale[wall_id] = (
+                                    Decimal(0) if left < done else subtract(left, done)
+                                )
+                                processing = {
+                                    "year": data["year"],
+                                    "month": data["month"],
+                                    "_done": data["done"],
+                                    "wall_id": wall_id,
+                                }
+                                rows.append((wall_local_id, processing))
+                        else:
+                            no_wall.append(wall_local_id)
+                saved, save_failures = cls.replace_items(Processing, new_wall_ids, rows)
+                success += saved
+                failures += save_failures
+                if progress:
+                    progress(rows_read, len(failures) + len(no_wall) + len(no_left))
         except Exception as e:
             return [
                 'An error occurred: "{}", while loading file: "{}"'.format(e, filename)
             ]
-        else:
-            for data in file:
-                wall_local_id = check_field_exists(data, "wall_id")
-                if wall_local_id:
-                    wall = (
-                        Wall.get_all_items(invest_id)
-                        .filter_by(local_id=wall_local_id)
-                        .first()
-                    )
-                    if wall:
-                        # deleting all processing with particular wall_id before uploading from csv
-                        if wall.id not in wall_ids:
-                            Processing.query.filter_by(wall_id=wall.id).delete()
-                            wall_ids.append(wall.id)
-                        if wall.left_to_sale == 0:
-                            no_left.append(wall_local_id)
-                            continue
-                        try:
-                            data = validate_processing(wall, data)
-                        except ValidationError:
-                            failures.append(wall_local_id)
-                        else:
-                            processing = Processing.create_item(**data)
-                            wall.processing.append(processing)
-                            db.session.add(wall)
-                            try:
-                                db.session.commit()
-                            except Exception:
-                                db.session.rollback()
-                                failures.append(wall_local_id)
-                            else:
-                                success += 1
-                    else:
-                        no_wall.append(wall_local_id)
-            return cls.create_upload_messages(success, failures, no_wall, no_left)
+        finally:
+            cls.refresh_metrics(left_to_sale)
+        return cls.create_upload_messages(success, failures, no_wall, no_left)
 
     @staticmethod
     def create_upload_messages(
@@ -733,3 +1091,181 @@ class Wall(db.Model):
 
     def __repr__(self) -> str:
         return "<Wall(id=%s)>" % (self.id,)
+
+
+class WallRollup(db.Model):
+    """Totals of areas of walls in the investment per sector, level, localization,
+    brick type and wall width. Areas are kept as integers in units of 0.01 m2 and
+    area left to sale in units of 0.0001 m2, so that applying deltas stays exact."""
+
+    __tablename__ = "wall_rollups"
+    DIMENSIONS = ["sector", "level", "localization", "brick_type", "wall_width"]
+    AREAS = [
+        "gross_wall_area",
+        "wall_area_to_survey",
+        "wall_area_to_sale",
+        "area_left_to_sale",
+    ]
+    __table_args__ = (db.UniqueConstraint("investment_id", *DIMENSIONS),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    investment_id = db.Column(
+        db.Integer, db.ForeignKey("investments.id", ondelete="CASCADE"), index=True
+    )
+    sector = db.Column(db.String(64))
+    level = db.Column(db.String(64))
+    localization = db.Column(db.String(128))
+    brick_type = db.Column(db.String(64))
+    wall_width = db.Column(db.Integer)
+    walls = db.Column(db.Integer, default=0)
+    gross_wall_area = db.Column(db.BigInteger, default=0)
+    wall_area_to_survey = db.Column(db.BigInteger, default=0)
+    wall_area_to_sale = db.Column(db.BigInteger, default=0)
+    area_left_to_sale = db.Column(db.BigInteger, default=0)
+
+    @staticmethod
+    def get_values(wall: Wall) -> Dict:
+        values = {
+            area: round((getattr(wall, "_" + area) or 0) * 100)
+            for area in ["gross_wall_area", "wall_area_to_survey", "wall_area_to_sale"]
+        }
+        values["area_left_to_sale"] = values["wall_area_to_sale"] * round(
+            (wall._left_to_sale or 0) * 100
+        )
+        return values
+
+    @classmethod
+    def apply(cls, invest_id: int, key: Dict, values: Dict, sign: int = 1) -> None:
+        """Adds areas of one wall to the rollup row of its dimensions, or subtracts
+        them. A new row is added only for a new key of a built rollup. When the
+        rollup of the investment has not been built yet, e.g. for investments
+        created before rollups, or the row to subtract from is missing, deltas
+        are skipped and the rollup is rebuilt from walls before commit."""
+
+        mark_investment_changed(invest_id)
+        if invest_id in db.session.info.get("stale_rollups", ()):
+            return
+        changes = {
+            getattr(cls, area): getattr(cls, area) + sign * values[area]
+            for area in cls.AREAS
+        }
+        changes[cls.walls] = cls.walls + sign
+        updated = cls.query.filter_by(investment_id=invest_id, **key).update(
+            changes, synchronize_session=False
+        )
+        if updated:
+            return
+        if sign < 0 or not cls.get_items(invest_id).first():
+            db.session.info.setdefault("stale_rollups", set()).add(invest_id)
+            return
+        row = dict(investment_id=invest_id, walls=1, **key, **values)
+        if db.engine.dialect.name == "postgresql":
+            # row of the same key may be inserted by a concurrent transaction
+            insert = pg_insert(cls.__table__).values(**row)
+            db.session.execute(
+                insert.on_conflict_do_update(
+                    index_elements=["investment_id", *cls.DIMENSIONS],
+                    set_={
+                        column: cls.__table__.c[column] + insert.excluded[column]
+                        for column in ["walls", *cls.AREAS]
+                    },
+                )
+            )
+        else:
+            db.session.add(cls(**row))
+
+    @classmethod
+    def rebuild(cls, invest_id: int) -> None:
+        """Replaces rollup rows of the investment with totals of its walls."""
+
+        mark_investment_changed(invest_id)
+        cls.query.filter_by(investment_id=invest_id).delete()
+        dimensions = [getattr(Wall, dimension) for dimension in cls.DIMENSIONS]
+        gross, survey, sale, left = [
+            cast(func.round(func.coalesce(column, 0) * 100), BigInteger)
+            for column in [
+                Wall._gross_wall_area,
+                Wall._wall_area_to_survey,
+                Wall._wall_area_to_sale,
+                Wall._left_to_sale,
+            ]
+        ]
+        totals = (
+            db.session.query(
+                Wall.investment_id,
+                *dimensions,
+                func.count(Wall.id),
+                func.sum(gross),
+                func.sum(survey),
+                func.sum(sale),
+                func.sum(sale * left),
+            )
+            .filter(Wall.investment_id == invest_id)
+            .group_by(Wall.investment_id, *dimensions)
+        )
+        db.session.execute(
+            cls.__table__.insert().from_select(
+                ["investment_id", *cls.DIMENSIONS, "walls", *cls.AREAS],
+                totals.subquery().select(),
+            )
+        )
+
+    @classmethod
+    def get_items(cls, invest_id: int) -> BaseQuery:
+        return cls.query.filter_by(investment_id=invest_id)
+
+    @classmethod
+    def get_categories(cls, invest_id: int) -> Dict:
+        """Returns sorted distinct values of each dimension of walls of the
+        investment, read in one query from its rollup rows."""
+
+        rows = (
+            cls.get_items(invest_id)
+            .filter(cls.walls > 0)
+            .with_entities(*[getattr(cls, dimension) for dimension in cls.DIMENSIONS])
+            .all()
+        )
+        return {
+            dimension: sorted({row[i] for row in rows if row[i] is not None})
+            for i, dimension in enumerate(cls.DIMENSIONS)
+        }
+
+
+def mark_investment_changed(invest_id: int) -> None:
+    """Marks walls of investment as changed in the current transaction, so data
+    cached for the investment is invalidated once the transaction is committed."""
+
+    db.session.info.setdefault("changed_investments", set()).add(invest_id)
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_changed_investments(session) -> None:
+    invest_ids = session.info.pop("changed_investments", None)
+    if invest_ids:
+        delete_cached_categories(r, invest_ids)
+        delete_cached_reports(r, invest_ids)
+        bump_data_versions(r, invest_ids)
+
+
+@event.listens_for(db.session, "before_commit")
+def rebuild_stale_rollups(session) -> None:
+    invest_ids = session.info.pop("stale_rollups", None)
+    if invest_ids:
+        session.flush()
+        for invest_id in invest_ids:
+            WallRollup.rebuild(invest_id)
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def forget_changed_investments(session, previous_transaction) -> None:
+    session.info.pop("changed_investments", None)
+    session.info.pop("stale_rollups", None)
+
+
+@event.listens_for(Wall, "expire")
+def clear_prefetched(wall: Wall, attrs: Iterable) -> None:
+    """Drops prefetched holes and processing once the wall is expired, e.g. on commit."""
+
+    # wall is None when modified wall has been garbage collected before rollback
+    if wall is not None:
+        wall.clear_prefetched()
@@ -3,3 +3,4 @@ from flask import Blueprint
 bp = Blueprint("masonry_works", __name__)
 
 from app.production.masonry_works import routes
+from app.production.masonry_works import commands
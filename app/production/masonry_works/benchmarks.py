@@ -0,0 +1,227 @@
+import os
+import platform
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import *
+
+import numpy as np
+import pandas as pd
+from flask import url_for
+from redis import ConnectionPool
+from sqlalchemy import event
+
+from app import db, r
+from app.handling_files import get_temp_path, remove
+from app.models import Investment, User, Wall, WallRollup, Worker
+from app.production.masonry_works.data_treatment import Categories, TotalAreas
+from app.redis_client import delete_cached_categories, delete_cached_reports
+
+SIZES = [1000, 10000, 100000]
+SECTORS = ["A", "B", "C", "D", "E", "F", "G"]
+BRICK_TYPES = ["YTONG", "SILKA", "POROTHERM", "MAX"]
+WALL_WIDTHS = [8, 12, 18, 24, 25]
+MONTHS = ["January", "February", "March", "April", "May", "June"]
+
+
+def is_same_redis(url: str, other: str) -> bool:
+    """Tells whether both Redis urls point to the same database of a server."""
+
+    def address(redis_url: str) -> Tuple:
+        kwargs = ConnectionPool.from_url(redis_url).connection_kwargs
+        return (
+            kwargs.get("host", "localhost"),
+            kwargs.get("port", 6379),
+            kwargs.get("path"),
+            int(kwargs.get("db", 0)),
+        )
+
+    return bool(url and other) and address(url) == address(other)
+
+
+def generate_data(n_walls: int, seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """Generates walls with holes and processing in the format of uploaded csv
+    files. Every wall has up to 3 holes and up to 3 processing entries which
+    never sell more than the whole wall. The same seed gives the same data."""
+
+    rng = np.random.default_rng(seed)
+    local_ids = np.arange(1, n_walls + 1)
+    floor_ord = rng.uniform(-3, 30, n_walls).round(2)
+    walls = pd.DataFrame(
+        {
+            "local_id": local_ids,
+            "sector": rng.choice(SECTORS, n_walls),
+            "level": rng.integers(-1, 10, n_walls),
+            "localization": [f"{i % 26}/{i % 7}" for i in local_ids],
+            "brick_type": rng.choice(BRICK_TYPES, n_walls),
+            "wall_width": rng.choice(WALL_WIDTHS, n_walls),
+            "wall_length": rng.uniform(0.5, 15, n_walls).round(3),
+            "floor_ord": floor_ord,
+            "ceiling_ord": (floor_ord + rng.uniform(2.5, 3.5, n_walls)).round(2),
+        }
+    )
+
+    n_holes = rng.integers(0, 4, n_walls)
+    hole_wall_ids = np.repeat(local_ids, n_holes)
+    holes = pd.DataFrame(
+        {
+            "wall_id": hole_wall_ids,
+            "width": rng.uniform(0.6, 2.5, len(hole_wall_ids)).round(3),
+            "height": rng.uniform(0.6, 2.5, len(hole_wall_ids)).round(2),
+            "amount": rng.integers(1, 4, len(hole_wall_ids)),
+        }
+    )
+
+    n_processing = rng.integers(0, 4, n_walls)
+    processing_wall_ids = np.repeat(local_ids, n_processing)
+    processing = pd.DataFrame(
+        {
+            "wall_id": processing_wall_ids,
+            "year": rng.choice([2020, 2021], len(processing_wall_ids)),
+            "month": rng.choice(MONTHS, len(processing_wall_ids)),
+            "done": rng.uniform(0.01, 0.33, len(processing_wall_ids)).round(2),
+        }
+    )
+    return {"walls": walls, "holes": holes, "processing": processing}
+
+
+class QueryCounter:
+    """Counts statements executed by the engine of the current app."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self) -> "QueryCounter":
+        event.listen(db.engine, "before_cursor_execute", self.increment)
+        return self
+
+    def __exit__(self, *args) -> None:
+        event.remove(db.engine, "before_cursor_execute", self.increment)
+
+    def increment(self, *args) -> None:
+        self.count += 1
+
+
+@contextmanager
+def measure(results: List, name: str, size: int) -> Iterator:
+    """Appends wall time, number of queries and peak memory allocated by Python
+    while the block runs to results. Memory is traced while timing, so times
+    are comparable between runs rather than with production."""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with QueryCounter() as counter:
+            yield
+    finally:
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    results.append(
+        {
+            "benchmark": name,
+            "walls": size,
+            "seconds": round(seconds, 6),
+            "queries": counter.count,
+            "peak_memory": peak,
+        }
+    )
+
+
+def create_investment() -> Tuple[User, Investment]:
+    user = User(username="benchmark", email="benchmark@email.com", password="benchmark")
+    user.is_active = True
+    db.session.add(user)
+    db.session.commit()
+    investment = Investment(name="Benchmark", description="benchmark data")
+    investment.workers.append(Worker(position="admin", admin=True, user_id=user.id))
+    db.session.add(investment)
+    db.session.commit()
+    user.current_invest_id = investment.id
+    db.session.commit()
+    return user, investment
+
+
+def run_size(app, size: int, seed: int) -> List[Dict]:
+    """Loads generated data of size walls into a new investment with the csv
+    importers and times the hot paths of the masonry works on it."""
+
+    results = []
+    user, investment = create_investment()
+    invest_id = investment.id
+    temp_path = get_temp_path()
+    os.makedirs(temp_path, exist_ok=True)
+    filenames = []
+    try:
+        for model, frame in generate_data(size, seed).items():
+            filename = f"benchmark_{model}_{size}.csv"
+            frame.to_csv(os.path.join(temp_path, filename), sep=";", index=False)
+            filenames.append(filename)
+            with measure(results, f"upload_{model}", size):
+                getattr(Wall, f"upload_{model}")(invest_id, filename)
+
+        with measure(results, "survey_hybrids", size):
+            for wall in Wall.prefetch(Wall.get_all_items(invest_id)):
+                wall.update_metrics(prefetched=True, rollup=False)
+                for hole in wall.get_holes():
+                    hole.total_area
+        db.session.rollback()
+
+        with measure(results, "total_areas", size):
+            total = TotalAreas(WallRollup.get_items(invest_id))
+            for area in WallRollup.AREAS:
+                getattr(total, area)
+
+        delete_cached_categories(r, [invest_id])
+        with measure(results, "categories", size):
+            Categories(invest_id).get_category("sector")
+        with measure(results, "categories_cached", size):
+            Categories(invest_id).get_category("sector")
+
+        with app.test_client() as client:
+            with client.session_transaction() as session:
+                session["_user_id"] = str(user.id)
+                session["_fresh"] = True
+            for name, args in [
+                ("walls_view", {}),
+                ("walls_view_sorted", {"sort": "gross_wall_area", "order": "desc"}),
+            ]:
+                with app.test_request_context():
+                    url = url_for("masonry_works.walls", **args)
+                with measure(results, name, size):
+                    response = client.get(url)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Walls view returned {response.status_code}.")
+    finally:
+        for filename in filenames:
+            remove(os.path.join(temp_path, filename))
+        delete_cached_categories(r, [invest_id])
+        delete_cached_reports(r, [invest_id])
+    return results
+
+
+def run_benchmarks(app, sizes: Iterable = None, seed: int = 0) -> Dict:
+    """Runs benchmarks for every size and returns results with the environment
+    they were measured in. The database of app is dropped and created again
+    and its Redis database is flushed before every size, so app has to be
+    configured with a scratch database and a scratch Redis database."""
+
+    results = []
+    for size in sizes or SIZES:
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        r.flushdb()
+        results += run_size(app, size, seed)
+    db.session.remove()
+    db.drop_all()
+    r.flushdb()
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "seed": seed,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": db.engine.dialect.name,
+        "results": results,
+    }
@@ -0,0 +1,107 @@
+import json
+from typing import *
+
+import click
+from sqlalchemy import exists
+
+from app import create_app, db
+from app.models import Wall, WallRollup
+from app.production.masonry_works import bp
+from app.production.masonry_works.benchmarks import is_same_redis, run_benchmarks
+from app.production.masonry_works.data_treatment import SurveyEngine
+from config import config
+
+
+def rebuild_metrics(invest_id: int) -> int:
+    """Recomputes stored areas of all walls in the investment in one vectorized
+    pass, writes them with a bulk update and rebuilds the rollup of the
+    investment. Returns number of walls."""
+
+    mappings = SurveyEngine.from_investment(invest_id).to_mappings()
+    db.session.bulk_update_mappings(Wall, mappings)
+    WallRollup.rebuild(invest_id)
+    db.session.commit()
+    return len(mappings)
+
+
+@bp.cli.command("rebuild-metrics")
+@click.argument("invest_id", type=int)
+def rebuild_metrics_command(invest_id: int) -> None:
+    """Rebuilds stored areas of walls for the investment."""
+
+    count = rebuild_metrics(invest_id)
+    click.echo("Rebuilt metrics of {} walls.".format(count))
+
+
+def backfill_rollups() -> List[int]:
+    """Builds rollups of investments which have walls but no rollup rows, e.g.
+    investments created before rollups were introduced. Returns their ids."""
+
+    invest_ids = [
+        invest_id
+        for invest_id, in db.session.query(Wall.investment_id)
+        .filter(~exists().where(WallRollup.investment_id == Wall.investment_id))
+        .distinct()
+    ]
+    for invest_id in invest_ids:
+        WallRollup.rebuild(invest_id)
+    db.session.commit()
+    return invest_ids
+
+
+@bp.cli.command("backfill-rollups")
+def backfill_rollups_command() -> None:
+    """Builds rollups of investments which have none yet."""
+
+    invest_ids = backfill_rollups()
+    click.echo("Built rollups of {} investments.".format(len(invest_ids)))
+
+
+@bp.cli.command("benchmark")
+@click.option(
+    "--size",
+    "sizes",
+    type=int,
+    multiple=True,
+    help="Number of generated walls, can be repeated. Defaults to 1k, 10k and 100k.",
+)
+@click.option("--seed", type=int, default=0, help="Seed of generated data.")
+@click.option(
+    "--database-url",
+    default="sqlite://",
+    help="Scratch database, its tables are dropped by the benchmark.",
+)
+@click.option(
+    "--redis-url",
+    required=True,
+    help="Scratch Redis database, it is flushed by the benchmark. "
+    "Must differ from REDIS_URL of the app.",
+)
+@click.option("--output", type=click.Path(dir_okay=False), default="benchmark.json")
+def benchmark_command(
+    sizes: Tuple, seed: int, database_url: str, redis_url: str, output: str
+) -> None:
+    """Times masonry works on generated walls and writes results as JSON."""
+
+    if is_same_redis(redis_url, config["REDIS_URL"]):
+        raise click.BadParameter(
+            "Redis database of the app can not be used by the benchmark.",
+            param_hint="--redis-url",
+        )
+    app = create_app(
+        dict(
+            config,
+            SQLALCHEMY_DATABASE_URI=database_url,
+            REDIS_URL=redis_url,
+            SECRET_KEY=config["SECRET_KEY"] or "benchmark",
+        )
+    )
+    with app.app_context():
+        report = run_benchmarks(app, sizes, seed)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    for result in report["results"]:
+        click.echo(
+            "{benchmark:>20} {walls:>7} walls: {seconds:10.3f} s "
+            "{queries:>7} queries {peak_memory:>12} B".format(**result)
+        )
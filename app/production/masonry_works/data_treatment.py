@@ -1,46 +1,624 @@
-from fractions import Fraction as frac
+import calendar
+import csv
+import operator
+from decimal import Decimal
+from io import StringIO
 from typing import *
 
+import numpy as np
+import pandas as pd
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import and_, func, or_
+
+from app import db, r
+from app.decimals import exact, multiply, subtract
+from app.models import Hole, Processing, Wall, WallRollup
+from app.redis_client import (
+    cache_categories,
+    cache_report,
+    get_cached_categories,
+    get_cached_report,
+)
+
+# Highest number of decimal places of the dimensions handled in fixed-point,
+# walls with more decimal places are computed in exact decimal arithmetic.
+MAX_EXPONENT = 6
+
+EXPORT_COLUMNS = Wall.CSV_FIELDS + [
+    "wall_height",
+    "gross_wall_area",
+    "wall_area_to_survey",
+    "wall_area_to_sale",
+    "left_to_sale",
+]
+EXPORT_BATCH_SIZE = 1000
+
+# columns of the walls table by which walls can be sorted
+SORT_COLUMNS = EXPORT_COLUMNS
+WALLS_PER_PAGE = 100
+
+# numbers of months written as names or numbers, other months are reported last
+MONTH_NUMBERS = {
+    **{name.lower(): number for number, name in enumerate(calendar.month_name)},
+    **{name.lower(): number for number, name in enumerate(calendar.month_abbr)},
+    **{str(number): number for number in range(1, 13)},
+    **{f"{number:02}": number for number in range(1, 13)},
+}
+MONTH_NUMBERS.pop("")
+
+# columns and types of tables of snapshot, holes and processing refer to
+# local ids of walls
+SNAPSHOT_COLUMNS = {
+    "walls": {
+        "local_id": "Int64",
+        "sector": "string",
+        "level": "string",
+        "localization": "string",
+        "brick_type": "string",
+        "wall_width": "Int64",
+        "wall_length": "float64",
+        "floor_ord": "float64",
+        "ceiling_ord": "float64",
+        "wall_height": "float64",
+        "gross_wall_area": "float64",
+        "wall_area_to_survey": "float64",
+        "wall_area_to_sale": "float64",
+        "left_to_sale": "float64",
+    },
+    "holes": {
+        "wall_id": "Int64",
+        "width": "float64",
+        "height": "float64",
+        "amount": "Int64",
+        "area": "float64",
+        "total_area": "float64",
+    },
+    "processing": {
+        "wall_id": "Int64",
+        "year": "Int64",
+        "month": "string",
+        "done": "float64",
+    },
+}
+
 
 class Categories:
-    def __init__(self, model):
-        self._model = model
+    """Distinct values of wall dimensions of the investment for filters of the
+    walls table, cached in Redis until walls of the investment change."""
+
+    def __init__(self, invest_id: int):
+        self._invest_id = invest_id
+        self._categories = None
 
     def get_category(self, category: str) -> List:
-        items = self._model.query.distinct(category)
-        categories = [item.__getattribute__(category) for item in items]
+        if self._categories is None:
+            self._categories = get_cached_categories(r, self._invest_id)
+        if self._categories is None:
+            self._categories = WallRollup.get_categories(self._invest_id)
+            cache_categories(r, self._invest_id, self._categories)
+        categories = list(self._categories[category])
         categories.insert(0, None)
         return categories
 
 
+class MonthlyReport:
+    """Area sold per month per sector and brick type, with cumulative area sold
+    and progress as percent of area to sale, for the investment and in total.
+    Sold areas are summed in one grouped query, cumulated with pandas and cached
+    in Redis until walls or processing of the investment change."""
+
+    GROUPS = ["sector", "brick_type"]
+
+    def __init__(self, invest_id: int):
+        self._invest_id = invest_id
+        self._report = None
+
+    @property
+    def rows(self) -> List[Dict]:
+        return self.get_report()["rows"]
+
+    @property
+    def totals(self) -> List[Dict]:
+        return self.get_report()["totals"]
+
+    def get_report(self) -> Dict:
+        if self._report is None:
+            self._report = get_cached_report(r, self._invest_id)
+        if self._report is None:
+            self._report = self.compute(self._invest_id)
+            cache_report(r, self._invest_id, self._report)
+        return self._report
+
+    @classmethod
+    def compute(cls, invest_id: int) -> Dict:
+        columns = [Processing.year, Processing.month, Wall.sector, Wall.brick_type]
+        sold = (
+            db.session.query(
+                *columns, func.sum(Processing._done * Wall._wall_area_to_sale)
+            )
+            .join(Wall, Processing.wall_id == Wall.id)
+            .filter(Wall.investment_id == invest_id)
+            .group_by(*columns)
+            .all()
+        )
+        sold = pd.DataFrame(
+            sold, columns=["year", "month", *cls.GROUPS, "sold"], dtype=object
+        )
+        sold["sold"] = sold["sold"].astype("float64")
+        sold["month_number"] = sold["month"].str.lower().map(MONTH_NUMBERS)
+        sold = sold.sort_values(
+            ["year", "month_number", "month", *cls.GROUPS], na_position="last"
+        )
+        to_sale = sum_areas(
+            WallRollup.get_items(invest_id),
+            *[getattr(WallRollup, group) for group in cls.GROUPS],
+        )
+        to_sale = pd.DataFrame(
+            [(*row[: len(cls.GROUPS)], row.wall_area_to_sale) for row in to_sale],
+            columns=[*cls.GROUPS, "to_sale"],
+            dtype=object,
+        )
+        to_sale["to_sale"] = to_sale["to_sale"].astype("float64") / 100
+
+        rows = sold.merge(to_sale, how="left", on=cls.GROUPS)
+        rows["cumulative_sold"] = rows.groupby(cls.GROUPS, dropna=False)[
+            "sold"
+        ].cumsum()
+        totals = (
+            sold.groupby(["year", "month_number", "month"], dropna=False, sort=False)[
+                "sold"
+            ]
+            .sum()
+            .reset_index()
+        )
+        totals["to_sale"] = to_sale["to_sale"].sum()
+        totals["cumulative_sold"] = totals["sold"].cumsum()
+        return {
+            "rows": cls.to_records(rows, ["year", "month", *cls.GROUPS]),
+            "totals": cls.to_records(totals, ["year", "month"]),
+        }
+
+    @staticmethod
+    def to_records(frame: pd.DataFrame, columns: List) -> List[Dict]:
+        frame = frame.copy()
+        frame["progress"] = (frame["cumulative_sold"] / frame["to_sale"] * 100).where(
+            frame["to_sale"] > 0
+        )
+        frame = frame[[*columns, "sold", "cumulative_sold", "progress"]].round(2)
+        return frame.astype(object).where(frame.notna(), None).to_dict("records")
+
+
+class WallsPage:
+    """Page of walls selected by query, ordered by one of SORT_COLUMNS and id,
+    with missing values last. Pages are selected with keyset pagination: next
+    page starts after (value, id) of the last wall of this page, so it is read
+    with one range scan of the index of the column however deep it is."""
+
+    def __init__(
+        self,
+        items: BaseQuery,
+        sort: str = "local_id",
+        order: str = "asc",
+        after: List = None,
+        per_page: int = WALLS_PER_PAGE,
+    ):
+        column = getattr(Wall, sort)
+        descending = order == "desc"
+        compare = operator.lt if descending else operator.gt
+        if after is not None:
+            value, wall_id = after
+            if value is None:
+                condition = and_(column.is_(None), compare(Wall.id, wall_id))
+            else:
+                condition = or_(
+                    column.is_(None),
+                    compare(column, value),
+                    and_(column == value, compare(Wall.id, wall_id)),
+                )
+            items = items.filter(condition)
+        items = (
+            items.order_by(None)
+            .order_by(
+                column.is_(None),
+                column.desc() if descending else column,
+                Wall.id.desc() if descending else Wall.id,
+            )
+            .limit(per_page + 1)
+        )
+        walls = Wall.prefetch(items)
+        self.items = walls[:per_page]
+        self.next_after = None
+        if len(walls) > per_page:
+            last = self.items[-1]
+            self.next_after = [getattr(last, column.property.key), last.id]
+
+
+def to_fixed_point(values: np.ndarray) -> Tuple[np.ndarray, int, np.ndarray]:
+    """Returns values as integers scaled by 10 ** exponent with mask of values
+    with more than MAX_EXPONENT decimal places. The result is exact in the
+    same way as exact(value) for other values, because their shortest decimal
+    representation has at most exponent decimal places. Missing and masked
+    values are returned as 0 and have to be handled by the caller."""
+
+    values = np.nan_to_num(values)
+    scale = 10**MAX_EXPONENT
+    irregular = np.rint(values * scale) / scale != values
+    values = np.where(irregular, 0, values)
+    for exponent in range(MAX_EXPONENT + 1):
+        scale = 10**exponent
+        scaled = np.rint(values * scale)
+        if np.array_equal(scaled / scale, values):
+            return scaled.astype(np.int64), exponent, irregular
+
+
+def round_fixed_point(values: np.ndarray, exponent: int) -> np.ndarray:
+    """Mirrors round(float(value / 10 ** exponent), 2) in exact arithmetic for every value."""
+
+    scale = 10**exponent
+    if len(values) and np.abs(values).max() >= 2**53:
+        floats = [value / scale for value in values.tolist()]
+    else:
+        floats = (values / scale).tolist()
+    return np.array([round(value, 2) for value in floats], dtype=float)
+
+
+def to_cents(values: np.ndarray) -> np.ndarray:
+    return np.rint(np.nan_to_num(values) * 100).astype(np.int64)
+
+
+def mask_missing(values: np.ndarray, missing: np.ndarray) -> np.ndarray:
+    return np.where(missing, np.nan, values)
+
+
+def rescale(values: np.ndarray, exponent: int, new_exponent: int) -> np.ndarray:
+    return values * 10 ** (new_exponent - exponent)
+
+
+class SurveyEngine:
+    """Computes the quantity survey of walls in one vectorized pass.
+
+    Walls, holes and processing are loaded as column arrays and converted
+    to fixed-point integers, so results are identical to the rounded
+    decimal arithmetic of the Wall and Hole hybrid properties.
+    """
+
+    def __init__(self, walls: np.ndarray, holes: np.ndarray, processing: np.ndarray):
+        self._walls = walls.reshape(-1, 4)
+        self._holes = holes.reshape(-1, 4)
+        self._processing = processing.reshape(-1, 2)
+        self._result = None
+
+    @classmethod
+    def from_query(cls, items: BaseQuery) -> "SurveyEngine":
+        """Loads columns of walls selected by query with holes and processing."""
+
+        ids = items.with_entities(Wall.id).order_by(None).subquery()
+        walls = items.with_entities(
+            Wall.id, Wall.wall_length, Wall.floor_ord, Wall.ceiling_ord
+        ).all()
+        holes = (
+            Hole.query.with_entities(Hole.wall_id, Hole.width, Hole.height, Hole.amount)
+            .filter(Hole.wall_id.in_(ids))
+            .all()
+        )
+        processing = (
+            Processing.query.with_entities(Processing.wall_id, Processing._done)
+            .filter(Processing.wall_id.in_(ids))
+            .all()
+        )
+        return cls(
+            np.array(walls, dtype=float),
+            np.array(holes, dtype=float),
+            np.array(processing, dtype=float),
+        )
+
+    @classmethod
+    def from_investment(cls, invest_id: int) -> "SurveyEngine":
+        return cls.from_query(Wall.get_all_items(invest_id))
+
+    def compute(self) -> pd.DataFrame:
+        """Returns DataFrame indexed by wall id with columns: wall_height,
+        gross_wall_area, wall_area_to_survey, wall_area_to_sale, left_to_sale.
+        Areas which cannot be computed because of missing dimensions are NaN."""
+
+        if self._result is None:
+            self._result = self.__compute()
+        return self._result
+
+    def to_mappings(self) -> List[Dict]:
+        """Returns computed areas as mappings of stored Wall columns, as
+        expected by bulk_update_mappings, with None for missing values."""
+
+        result = self.compute()
+        result = result.astype(object).where(result.notna(), None)
+        return [
+            {
+                "id": wall_id,
+                "_wall_height": row.wall_height,
+                "_gross_wall_area": row.gross_wall_area,
+                "_wall_area_to_survey": row.wall_area_to_survey,
+                "_wall_area_to_sale": row.wall_area_to_sale,
+                "_left_to_sale": row.left_to_sale,
+            }
+            for wall_id, row in zip(result.index.tolist(), result.itertuples())
+        ]
+
+    def __compute(self) -> pd.DataFrame:
+        wall_ids = self._walls[:, 0].astype(np.int64)
+        length, length_exp, irregular = to_fixed_point(self._walls[:, 1])
+        ordinates, ord_exp, irregular_ords = to_fixed_point(self._walls[:, 2:4])
+        irregular |= irregular_ords.any(axis=1)
+        height = ordinates[:, 1] - ordinates[:, 0]
+        gross = length * height
+        gross_exp = length_exp + ord_exp
+        no_height = np.isnan(self._walls[:, 2:4]).any(axis=1)
+        no_gross = no_height | np.isnan(self._walls[:, 1])
+
+        survey_cents, sale_cents, no_holes = self.__compute_holes(wall_ids, irregular)
+        area_exp = max(gross_exp, 2)
+        area = rescale(gross, gross_exp, area_exp)
+        to_survey = area - rescale(survey_cents, 2, area_exp)
+        to_sale = area - rescale(sale_cents, 2, area_exp)
+
+        left, left_exp, no_left = self.__compute_left_to_sale(wall_ids, irregular)
+
+        result = pd.DataFrame(
+            {
+                "wall_height": mask_missing(
+                    round_fixed_point(height, ord_exp), no_height
+                ),
+                "gross_wall_area": mask_missing(
+                    round_fixed_point(gross, gross_exp), no_gross
+                ),
+                "wall_area_to_survey": mask_missing(
+                    round_fixed_point(to_survey, area_exp), no_gross | no_holes
+                ),
+                "wall_area_to_sale": mask_missing(
+                    round_fixed_point(to_sale, area_exp), no_gross | no_holes
+                ),
+                "left_to_sale": mask_missing(
+                    round_fixed_point(left, left_exp), no_left
+                ),
+            },
+            index=pd.Index(wall_ids, name="id"),
+        )
+        for position in np.flatnonzero(irregular).tolist():
+            result.iloc[position] = self.__compute_exact(wall_ids[position])
+        return result
+
+    def __compute_exact(self, wall_id: int) -> List:
+        """Computes the survey of one wall from its rows in exact decimal
+        arithmetic, as the hybrid properties of Wall do, for walls with values
+        which do not fit in fixed-point."""
+
+        length, floor_ord, ceiling_ord = self._walls[self._walls[:, 0] == wall_id, 1:4][
+            0
+        ].tolist()
+        holes = self._holes[self._holes[:, 0] == wall_id, 1:4].tolist()
+        done = self._processing[self._processing[:, 0] == wall_id, 1].tolist()
+
+        def height() -> Decimal:
+            return subtract(exact(ceiling_ord), exact(floor_ord))
+
+        def gross() -> Decimal:
+            return multiply(exact(length), height())
+
+        def to_survey() -> Decimal:
+            area = gross()
+            for width, hole_height, amount in holes:
+                total = multiply(
+                    multiply(exact(width), exact(hole_height)), exact(amount)
+                )
+                area = subtract(area, exact(round(float(total), 2)))
+            return area
+
+        def to_sale() -> Decimal:
+            area = gross()
+            for width, hole_height, amount in holes:
+                hole_area = multiply(exact(width), exact(hole_height))
+                if round(float(hole_area), 2) >= 3:
+                    total = exact(round(float(multiply(hole_area, exact(amount))), 2))
+                    area = subtract(area, subtract(total, exact(amount)))
+            return area
+
+        def left_to_sale() -> Decimal:
+            left = Decimal(1)
+            for value in done:
+                if left < exact(value):
+                    return Decimal(0)
+                left = subtract(left, exact(value))
+            return left
+
+        values = []
+        for compute in [height, gross, to_survey, to_sale, left_to_sale]:
+            try:
+                values.append(round(float(compute()), 2))
+            except ValueError:
+                values.append(np.nan)
+        return values
+
+    def __compute_holes(
+        self, wall_ids: np.ndarray, irregular: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns sums of rounded total areas of holes per wall in cents, for
+        the area to survey and for the area to sale, and mask of walls with
+        holes of missing dimensions. Walls with holes which do not fit in
+        fixed-point are marked as irregular."""
+
+        survey_cents = np.zeros(len(wall_ids), dtype=np.int64)
+        sale_cents = np.zeros(len(wall_ids), dtype=np.int64)
+        no_holes = np.zeros(len(wall_ids), dtype=bool)
+        if not len(self._holes):
+            return survey_cents, sale_cents, no_holes
+        positions = pd.Index(wall_ids).get_indexer(self._holes[:, 0].astype(np.int64))
+        no_holes[positions[np.isnan(self._holes[:, 1:4]).any(axis=1)]] = True
+        sizes, size_exp, irregular_sizes = to_fixed_point(self._holes[:, 1:3])
+        amounts, _, irregular_amounts = to_fixed_point(self._holes[:, 3])
+        irregular[positions[irregular_sizes.any(axis=1) | irregular_amounts]] = True
+        area = sizes[:, 0] * sizes[:, 1]
+        area_exp = 2 * size_exp
+        total_area = to_cents(round_fixed_point(area * amounts, area_exp))
+        below_3m2 = round_fixed_point(area, area_exp) < 3
+        np.add.at(survey_cents, positions, total_area)
+        np.add.at(
+            sale_cents,
+            positions,
+            np.where(below_3m2, 0, total_area - amounts * 100),
+        )
+        return survey_cents, sale_cents, no_holes
+
+    def __compute_left_to_sale(
+        self, wall_ids: np.ndarray, irregular: np.ndarray
+    ) -> Tuple[np.ndarray, int, np.ndarray]:
+        """Returns left_to_sale per wall scaled by 10 ** exponent and mask of walls
+        with missing done values. Done values are not negative, so left_to_sale
+        drops to 0 as soon as their sum exceeds 1. Walls with done values which
+        do not fit in fixed-point are marked as irregular."""
+
+        no_left = np.zeros(len(wall_ids), dtype=bool)
+        if not len(self._processing):
+            return np.ones(len(wall_ids), dtype=np.int64), 0, no_left
+        positions = pd.Index(wall_ids).get_indexer(
+            self._processing[:, 0].astype(np.int64)
+        )
+        no_left[positions[np.isnan(self._processing[:, 1])]] = True
+        done, done_exp, irregular_done = to_fixed_point(self._processing[:, 1])
+        irregular[positions[irregular_done]] = True
+        whole = 10**done_exp
+        total_done = np.zeros(len(wall_ids), dtype=np.int64)
+        np.add.at(total_done, positions, done)
+        return np.where(total_done > whole, 0, whole - total_done), done_exp, no_left
+
+    def total(self, column: str) -> float:
+        return round(int(to_cents(self.compute()[column].values).sum()) / 100, 2)
+
+    def total_left_to_sale(self) -> float:
+        result = self.compute()
+        area = to_cents(result["wall_area_to_sale"].values)
+        left = to_cents(result["left_to_sale"].values)
+        return round(int((area * left).sum()) / 10**4, 2)
+
+
+def sum_areas(items: BaseQuery, *group_by) -> List:
+    """Sums rollup rows selected by query in one query on the database side,
+    optionally grouped by rollup dimensions. Areas are in rollup units."""
+
+    return (
+        items.with_entities(
+            *group_by,
+            *[
+                func.sum(getattr(WallRollup, area)).label(area)
+                for area in WallRollup.AREAS
+            ],
+        )
+        .order_by(None)
+        .group_by(*group_by)
+        .all()
+    )
+
+
 class TotalAreas:
-    def __init__(self, items: List):
+    def __init__(self, items: BaseQuery):
         self._items = items
+        self._totals = None
+
+    def get_total(self, area: str, scale: int = 100) -> float:
+        if self._totals is None:
+            self._totals = sum_areas(self._items)[0]
+        return round(int(getattr(self._totals, area) or 0) / scale, 2)
 
     @property
     def gross_wall_area(self) -> float:
-        area = frac("0")
-        for item in self._items:
-            area += frac(str(item.gross_wall_area))
-        return round(float(area), 2)
+        return self.get_total("gross_wall_area")
 
     @property
     def wall_area_to_survey(self) -> float:
-        area = frac("0")
-        for item in self._items:
-            area += frac(str(item.wall_area_to_survey))
-        return round(float(area), 2)
+        return self.get_total("wall_area_to_survey")
 
     @property
     def wall_area_to_sale(self) -> float:
-        area = frac("0")
-        for item in self._items:
-            area += frac(str(item.wall_area_to_sale))
-        return round(float(area), 2)
+        return self.get_total("wall_area_to_sale")
 
     @property
     def area_left_to_sale(self) -> float:
-        area = frac("0")
-        for item in self._items:
-            area += frac(str(item.wall_area_to_sale)) * frac(str(item.left_to_sale))
-        return round(float(area), 2)
+        return self.get_total("area_left_to_sale", scale=10**4)
+
+
+def export_walls(items: BaseQuery, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator:
+    """Yields walls selected by query with their stored areas as csv text in
+    the format of uploaded files, one batch of rows at a time. Rows are fetched
+    with yield_per, so the whole file is never held in memory."""
+
+    buffer = StringIO()
+    writer = csv.writer(buffer, delimiter=";")
+    writer.writerow(EXPORT_COLUMNS)
+    rows = items.with_entities(
+        *[getattr(Wall, column) for column in EXPORT_COLUMNS]
+    ).yield_per(batch_size)
+    for i, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if i % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def get_snapshot(invest_id: int) -> Dict:
+    """Returns walls of investment with their stored areas, holes and processing
+    as DataFrames typed according to SNAPSHOT_COLUMNS."""
+
+    walls = Wall.get_all_items(invest_id)
+    ids = walls.with_entities(Wall.id).subquery()
+    queries = {
+        "walls": walls.with_entities(
+            *[getattr(Wall, column) for column in SNAPSHOT_COLUMNS["walls"]]
+        ).order_by(Wall.local_id),
+        "holes": Hole.query.join(Wall, Wall.id == Hole.wall_id)
+        .filter(Hole.wall_id.in_(ids))
+        .with_entities(
+            Wall.local_id,
+            Hole.width,
+            Hole.height,
+            Hole.amount,
+        )
+        .order_by(Wall.local_id, Hole.id),
+        "processing": Processing.query.join(Wall, Wall.id == Processing.wall_id)
+        .filter(Processing.wall_id.in_(ids))
+        .with_entities(
+            Wall.local_id, Processing.year, Processing.month, Processing._done
+        )
+        .order_by(Wall.local_id, Processing.id),
+    }
+    frames = {}
+    for table, query in queries.items():
+        columns = SNAPSHOT_COLUMNS[table]
+        names = list(columns)[: len(query.column_descriptions)]
+        frame = pd.DataFrame(query.all(), columns=names)
+        if table == "holes":
+            frame = frame.assign(**get_hole_areas(frame))
+        frames[table] = frame.astype(columns)
+    return frames
+
+
+def get_hole_areas(holes: pd.DataFrame) -> Dict[str, List]:
+    """Returns area and total area of holes rounded as by the Hole hybrid
+    properties. They are computed here rather than in SQL, since databases
+    round half-cent ties of exact products differently."""
+
+    areas = {"area": [], "total_area": []}
+    for width, height, amount in zip(
+        holes["width"].tolist(), holes["height"].tolist(), holes["amount"].tolist()
+    ):
+        try:
+            area = multiply(exact(width), exact(height))
+        except ValueError:
+            areas["area"].append(None)
+            areas["total_area"].append(None)
+            continue
+        areas["area"].append(round(float(area), 2))
+        try:
+            areas["total_area"].append(round(float(multiply(area, exact(amount))), 2))
+        except ValueError:
+            areas["total_area"].append(None)
+    return areas
@@ -1,49 +1,185 @@
-from flask import render_template, flash, redirect, url_for, request, g
-from flask_login import login_required
+import hashlib
+import json
+import os
+from typing import *
+from uuid import uuid4
+
+from flask import (
+    Response,
+    stream_with_context,
+    render_template,
+    flash,
+    redirect,
+    url_for,
+    request,
+    g,
+    abort,
+    jsonify,
+)
+from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
 
-from app.handling_files import allowed_file, save_file, handle_csv
+from app import r
+from app.app_tasks import tasks
+from app.handling_files import (
+    IMPORT_MODELS,
+    allowed_file,
+    get_temp_path,
+    get_user_path,
+    save_file,
+)
 from app.main.forms import WarrantyForm
-from app.models import Hole, Processing, Wall
+from app.models import Hole, Processing, Wall, WallRollup
 from app.production.masonry_works import bp
-from app.production.masonry_works.data_treatment import TotalAreas, Categories
+from app.production.masonry_works.data_treatment import (
+    SORT_COLUMNS,
+    TotalAreas,
+    Categories,
+    MonthlyReport,
+    WallsPage,
+    export_walls,
+)
 from app.production.masonry_works.forms import (
     WallForm,
     HoleForm,
     ProcessingForm,
 )
+from app.redis_client import (
+    create_import_progress,
+    get_data_version,
+    get_import_progress,
+)
+
+
+def get_filters() -> Dict:
+    """Returns values of rollup dimensions chosen in the walls table."""
+
+    filters = {}
+    for dimension in WallRollup.DIMENSIONS:
+        value = request.args.get(dimension)
+        if value:
+            filters[dimension] = value
+    return filters
+
+
+def get_after(sort: str) -> Union[List, None]:
+    """Returns (value, id) of the last wall of the previous page of walls table
+    sorted by sort column. Values not matching the type of the column are
+    ignored, so the first page is shown instead."""
+
+    try:
+        after = json.loads(request.args.get("after", "null"))
+    except ValueError:
+        return None
+    python_type = getattr(Wall, sort).type.python_type
+    # integers are written to json without decimal point also in float columns
+    types = (int, float) if python_type is float else python_type
+    if (
+        isinstance(after, list)
+        and len(after) == 2
+        and (
+            after[0] is None
+            or isinstance(after[0], types)
+            and not isinstance(after[0], bool)
+        )
+        and isinstance(after[1], int)
+        and not isinstance(after[1], bool)
+    ):
+        return after
+
+
+def get_walls_page(filters: Dict) -> Tuple[WallsPage, Dict]:
+    """Returns page of walls of the current investment selected by filters and
+    sorted as requested, with arguments of the request selecting the page."""
+
+    sort = request.args.get("sort")
+    if sort not in SORT_COLUMNS:
+        sort = "local_id"
+    order = "desc" if request.args.get("order") == "desc" else "asc"
+    items = Wall.get_all_items(g.current_invest.id).filter_by(**filters)
+    page = WallsPage(items, sort, order, get_after(sort))
+    return page, dict(filters, sort=sort, order=order)
 
 
 @bp.route("/walls")
 @login_required
 def walls() -> str:
-    sector = request.args.get("sector")
-    level = request.args.get("level")
-    localization = request.args.get("localization")
-    brick_type = request.args.get("brick_type")
-    wall_width = request.args.get("wall_width")
-    items = Wall.get_all_items(g.current_invest.id)
-    if sector:
-        items = items.filter_by(sector=sector)
-    if level:
-        items = items.filter_by(level=level)
-    if localization:
-        items = items.filter_by(localization=localization)
-    if brick_type:
-        items = items.filter_by(brick_type=brick_type)
-    if wall_width:
-        items = items.filter_by(wall_width=wall_width)
-    items = items.order_by("local_id").all()
-    total = TotalAreas(items)
+    filters = get_filters()
+    page, args = get_walls_page(filters)
+    total = TotalAreas(WallRollup.get_items(g.current_invest.id).filter_by(**filters))
     return render_template(
         "production/masonry_works/walls.html",
         title="Walls",
-        items=items,
+        items=page.items,
+        page=page,
+        args=args,
         total=total,
-        categories=Categories(Wall),
+        categories=Categories(g.current_invest.id),
+    )
+
+
+@bp.route("/monthly_report")
+@login_required
+def monthly_report() -> str:
+    return render_template(
+        "production/masonry_works/monthly_report.html",
+        title="Monthly report",
+        report=MonthlyReport(g.current_invest.id),
+    )
+
+
+@bp.route("/api/walls")
+@login_required
+def api_walls() -> Response:
+    """Returns page of filtered walls with their areas as JSON. The ETag changes
+    with data version of investment, so unchanged data is answered with 304
+    without reading walls."""
+
+    version = get_data_version(r, g.current_invest.id)
+    args = hashlib.md5(request.query_string).hexdigest()
+    etag = f"{g.current_invest.id}-{version}-{args}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    page, _ = get_walls_page(get_filters())
+    response = jsonify(
+        walls=[
+            {column: getattr(wall, column) for column in ["id", *SORT_COLUMNS]}
+            for wall in page.items
+        ],
+        next_after=page.next_after,
+    )
+    response.set_etag(etag)
+    return response
+
+
+@bp.route("/export_walls")
+@login_required
+def export_walls_to_csv() -> Response:
+    items = Wall.get_all_items(g.current_invest.id).filter_by(**get_filters())
+    items = items.order_by("local_id")
+    return Response(
+        stream_with_context(export_walls(items)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=walls.csv"},
     )
 
 
+@bp.route("/export_snapshot")
+@login_required
+def export_snapshot() -> str:
+    tasks.export_snapshot.delay(
+        get_user_path(current_user.id, g.current_invest.id),
+        g.current_invest.id,
+        g.current_worker.id,
+    )
+    flash(
+        "The export is started. Wait for notification that you can download the file."
+    )
+    return redirect(url_for("masonry_works.walls"))
+
+
 @bp.route("/holes")
 @login_required
 def holes() -> str:
@@ -273,30 +409,55 @@ def upload_files() -> str:
             flash("Choose investment first.")
             return redirect(url_for("investments.invest_list"))
         model = request.args.get("model")
-        if not model:
-            return redirect(url_for("masonry_works.wall"))
+        if model not in IMPORT_MODELS:
+            flash("Unknown kind of imported data.")
+            return redirect(url_for("masonry_works.walls"))
         if "file[]" not in request.files:
             flash("No file part.")
             return redirect(request.url)
         files = request.files.getlist("file[]")
+        # snapshots exported from investments are imported from zip files
+        extensions = {"zip"} if model == "snapshot" else None
+        # files of the job are kept apart, so names do not collide with other
+        # imports and the job removes them whatever its result is
+        job_id = str(uuid4())
+        filenames = []
         for file in files:
             if file.filename == "":
                 flash("No selected file.")
                 return redirect(request.url)
-            if file and allowed_file(file.filename):
+            if file and allowed_file(file.filename, extensions):
                 filename = secure_filename(file.filename)
                 try:
                     save_file(
                         file=file,
-                        file_dir="",
+                        file_dir=os.path.join(get_temp_path(), job_id),
                         filename=filename,
-                        temp=True,
                     )
                 except FileExistsError:
                     flash("File with this name already exists.")
                 else:
-                    messages = handle_csv(filename, g.current_invest.id, model, Wall)
-                    for message in messages:
-                        flash(message)
+                    filenames.append(filename)
+        if filenames:
+            # files are parsed in parallel and written by one job
+            create_import_progress(r, job_id, g.current_worker.id, ", ".join(filenames))
+            tasks.import_files.apply_async(
+                args=(filenames, g.current_invest.id, model, g.current_worker.id),
+                task_id=job_id,
+            )
+            flash(
+                "The import of {} is started. Wait for notification that it is finished.".format(
+                    ", ".join(filenames)
+                )
+            )
         return redirect(url_for("masonry_works.walls"))
     return render_template("upload_file_form.html")
+
+
+@bp.route("/import_status/<job_id>")
+@login_required
+def import_status(job_id: str) -> str:
+    progress = get_import_progress(r, job_id)
+    if progress.get("worker_id") != g.current_worker.id:
+        abort(404)
+    return jsonify(progress)
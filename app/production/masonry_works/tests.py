@@ -1,14 +1,46 @@
+import json
+import os
+from fractions import Fraction as frac
+from io import BytesIO
+from typing import *
+
+import pytest
 from flask import url_for
 from flask_login import current_user
 
+from app import db, r
+from app.app_tasks.tasks import import_files
+from app.handling_files import (
+    get_temp_path,
+    handle_snapshot,
+    remove,
+    write_snapshot,
+)
 from app.main.forms import WarrantyForm
-from app.models import Wall, Hole, Processing, Investment
-from app.production.masonry_works.data_treatment import Categories, TotalAreas
+from app.models import Wall, WallRollup, Hole, Processing, Investment, Worker
+from app.production.masonry_works.benchmarks import (
+    generate_data,
+    is_same_redis,
+    run_benchmarks,
+)
+from app.production.masonry_works.commands import backfill_rollups, rebuild_metrics
+from app.production.masonry_works.data_treatment import (
+    Categories,
+    MonthlyReport,
+    SurveyEngine,
+    TotalAreas,
+    WallsPage,
+    export_walls,
+    get_snapshot,
+    sum_areas,
+)
 from app.production.masonry_works.forms import (
     WallForm,
     HoleForm,
     ProcessingForm,
 )
+from app.redis_client import create_import_progress, get_import_progress
+from config import config
 
 
 class TestWalls:
@@ -425,3 +457,656 @@ class TestDeleteProcessing:
         assert response.status_code == 200
         assert b"Processing has been deleted." in response.data
         assert not Processing.query.first()
+
+
+class TestSurveyEngine:
+    @staticmethod
+    def test_compute(add_walls):
+        investment = Investment.query.first()
+        result = SurveyEngine.from_investment(investment.id).compute()
+        walls = Wall.query.all()
+        assert len(result) == len(walls)
+        for wall in walls:
+            row = result.loc[wall.id]
+            assert row["wall_height"] == wall.wall_height
+            assert row["gross_wall_area"] == wall.gross_wall_area
+            assert row["wall_area_to_survey"] == wall.wall_area_to_survey
+            assert row["wall_area_to_sale"] == wall.wall_area_to_sale
+            assert row["left_to_sale"] == wall.left_to_sale
+
+    @staticmethod
+    def test_compute_when_more_decimal_places(add_walls):
+        investment = Investment.query.first()
+        walls = Wall.query.order_by(Wall.id).all()
+        walls[0].wall_length = 10.3333333
+        Hole.query.filter_by(wall_id=walls[1].id).first().width = 1.3333333
+        Processing.query.filter_by(wall_id=walls[2].id).first()._done = 0.1234567
+        db.session.commit()
+        Wall.refresh_metrics(wall.id for wall in walls)
+        result = SurveyEngine.from_investment(investment.id).compute()
+        for wall in Wall.query.all():
+            row = result.loc[wall.id]
+            assert row["wall_height"] == wall.wall_height
+            assert row["gross_wall_area"] == wall.gross_wall_area
+            assert row["wall_area_to_survey"] == wall.wall_area_to_survey
+            assert row["wall_area_to_sale"] == wall.wall_area_to_sale
+            assert row["left_to_sale"] == wall.left_to_sale
+        assert rebuild_metrics(investment.id) == len(walls)
+
+    @staticmethod
+    def test_compute_when_no_walls(add_investment):
+        investment = Investment.query.first()
+        assert SurveyEngine.from_investment(investment.id).compute().empty
+
+    @staticmethod
+    def test_total(add_walls):
+        investment = Investment.query.first()
+        survey = SurveyEngine.from_investment(investment.id)
+        walls = Wall.query.all()
+        for attr in ["gross_wall_area", "wall_area_to_survey", "wall_area_to_sale"]:
+            area = sum(frac(str(getattr(wall, attr))) for wall in walls)
+            assert survey.total(attr) == round(float(area), 2)
+        area = sum(
+            frac(str(wall.wall_area_to_sale)) * frac(str(wall.left_to_sale))
+            for wall in walls
+        )
+        assert survey.total_left_to_sale() == round(float(area), 2)
+
+
+class TestTotalAreas:
+    @staticmethod
+    def test_hybrid_expressions(add_wall, add_hole, add_processing):
+        wall = Wall.query.first()
+        for attr in [
+            "wall_height",
+            "gross_wall_area",
+            "wall_area_to_survey",
+            "wall_area_to_sale",
+            "left_to_sale",
+        ]:
+            value = Wall.query.with_entities(getattr(Wall, attr)).scalar()
+            assert float(value) == getattr(wall, attr)
+
+    @staticmethod
+    def test_total_areas(add_wall, add_hole, add_processing):
+        Wall.add_wall(
+            invest_id=Investment.query.first().id,
+            local_id=2,
+            sector="F",
+            wall_length=4.5,
+            floor_ord=0.0,
+            ceiling_ord=3.0,
+        )
+        total = TotalAreas(WallRollup.query)
+        assert total.gross_wall_area == 46.05
+        assert total.wall_area_to_survey == 40.65
+        assert total.wall_area_to_sale == 46.05
+        assert total.area_left_to_sale == 33.03
+        total = TotalAreas(WallRollup.query.filter_by(sector="F"))
+        assert total.gross_wall_area == 13.5
+        assert total.area_left_to_sale == 13.5
+
+    @staticmethod
+    def test_sum_areas_grouped(add_walls):
+        investment = Investment.query.first()
+        survey = SurveyEngine.from_investment(investment.id).compute()
+        rows = sum_areas(WallRollup.get_items(investment.id), WallRollup.sector)
+        assert sorted(row.sector for row in rows) == ["F", "G"]
+        for row in rows:
+            ids = [wall.id for wall in Wall.query.filter_by(sector=row.sector)]
+            expected = survey.loc[ids, "gross_wall_area"].sum()
+            assert row.gross_wall_area == round(expected * 100)
+
+    @staticmethod
+    def test_total_areas_when_no_walls(add_investment):
+        total = TotalAreas(WallRollup.query)
+        assert total.gross_wall_area == 0
+        assert total.area_left_to_sale == 0
+
+
+class TestMetrics:
+    @staticmethod
+    def test_stored_after_writes(add_wall, add_hole, add_processing):
+        wall = Wall.query.first()
+        assert wall._gross_wall_area == 32.55
+        assert wall._wall_area_to_survey == 27.15
+        assert wall._left_to_sale == 0.6
+        Wall.delete_hole(Hole.query.first().id)
+        Wall.delete_processing(Processing.query.first().id)
+        wall = Wall.query.first()
+        assert wall._wall_area_to_survey == 32.55
+        assert wall._left_to_sale == 1.0
+
+    @staticmethod
+    def test_order_by_stored_area(add_walls):
+        walls = Wall.query.order_by(Wall.gross_wall_area).all()
+        areas = [wall.gross_wall_area for wall in walls]
+        assert areas == sorted(areas)
+
+    @staticmethod
+    def test_rebuild_metrics(add_walls):
+        investment = Investment.query.first()
+        expected = {
+            wall.id: (wall.wall_area_to_survey, wall.left_to_sale)
+            for wall in Wall.query.all()
+        }
+        Wall.query.update({"_wall_area_to_survey": 0, "_left_to_sale": None})
+        db.session.commit()
+        assert rebuild_metrics(investment.id) == len(expected)
+        for wall in Wall.query.all():
+            assert (wall._wall_area_to_survey, wall._left_to_sale) == expected[wall.id]
+
+    @staticmethod
+    def test_rebuild_metrics_command(app_and_db, add_wall):
+        investment = Investment.query.first()
+        runner = app_and_db[0].test_cli_runner()
+        result = runner.invoke(
+            args=["masonry_works", "rebuild-metrics", str(investment.id)]
+        )
+        assert "Rebuilt metrics of 1 walls." in result.output
+
+
+class TestWallRollup:
+    @staticmethod
+    def get_totals(invest_id: int) -> Dict:
+        totals = {}
+        for rollup in WallRollup.get_items(invest_id):
+            key = tuple(getattr(rollup, dim) for dim in WallRollup.DIMENSIONS)
+            totals[key] = (
+                rollup.walls,
+                *[getattr(rollup, a) for a in WallRollup.AREAS],
+            )
+        return totals
+
+    def test_deltas_match_rebuild(self, add_walls):
+        investment = Investment.query.first()
+        walls = Wall.query.order_by(Wall.id).all()
+        Wall.add_hole(walls[0].id, width=2.0, height=2.0, amount=1)
+        Wall.edit_hole(Hole.query.first().id, width=1.5)
+        Wall.add_processing(walls[1].id, year=2021, month="January", done=0.2)
+        Wall.delete_processing(Processing.query.first().id)
+        Wall.edit_wall(walls[2].id, sector="A", wall_length=8.0)
+        Wall.delete_wall(walls[3].id)
+        totals = self.get_totals(investment.id)
+        WallRollup.rebuild(investment.id)
+        db.session.commit()
+        # rows emptied by deltas are kept with zero walls
+        totals = {key: value for key, value in totals.items() if value[0]}
+        assert totals == self.get_totals(investment.id)
+
+    def test_deltas_when_rollup_not_built(self, add_walls):
+        investment = Investment.query.first()
+        expected = self.get_totals(investment.id)
+        WallRollup.get_items(investment.id).delete()
+        db.session.commit()
+        walls = Wall.query.order_by(Wall.id).all()
+        Wall.edit_wall(walls[2].id, sector="A", wall_length=8.0)
+        Wall.delete_wall(walls[3].id)
+        totals = self.get_totals(investment.id)
+        assert all(value >= 0 for row in totals.values() for value in row)
+        WallRollup.rebuild(investment.id)
+        db.session.commit()
+        assert totals == self.get_totals(investment.id) != expected
+
+    def test_delta_when_row_missing(self, add_walls):
+        investment = Investment.query.first()
+        wall = Wall.query.order_by(Wall.id).first()
+        key, _ = wall.get_rollup_entry()
+        WallRollup.get_items(investment.id).filter_by(**key).delete()
+        db.session.commit()
+        Wall.delete_wall(wall.id)
+        totals = self.get_totals(investment.id)
+        WallRollup.rebuild(investment.id)
+        db.session.commit()
+        assert totals == self.get_totals(investment.id)
+
+    def test_backfill_rollups(self, add_walls):
+        investment = Investment.query.first()
+        expected = self.get_totals(investment.id)
+        WallRollup.query.delete()
+        db.session.commit()
+        assert backfill_rollups() == [investment.id]
+        assert self.get_totals(investment.id) == expected
+        assert backfill_rollups() == []
+
+    @staticmethod
+    def test_walls_total_filtered(
+        client, captured_templates, test_with_authenticated_user, add_walls
+    ):
+        response = client.get(url_for("masonry_works.walls", sector="F"))
+        assert response.status_code == 200
+        template, context = captured_templates[0]
+        walls = Wall.query.filter_by(sector="F").all()
+        assert context["items"] == walls
+        assert context["total"].gross_wall_area == round(
+            float(sum(frac(str(wall.gross_wall_area)) for wall in walls)), 2
+        )
+
+
+class TestUploadFiles:
+    @staticmethod
+    def test_post(client, test_with_authenticated_user, add_investment, mocker):
+        mocker.patch("app.app_tasks.tasks.import_files.apply_async")
+        data = {"file[]": (BytesIO(b"local_id;sector\n1;A\n"), "upload_walls.csv")}
+        try:
+            response = client.post(
+                url_for("masonry_works.upload_files", model="walls"),
+                data=data,
+                content_type="multipart/form-data",
+            )
+            assert response.status_code == 302
+            import_files.apply_async.assert_called_once()
+            args = import_files.apply_async.call_args[1]["args"]
+            job_id = import_files.apply_async.call_args[1]["task_id"]
+            assert args[0] == ["upload_walls.csv"]
+            assert args[2] == "walls"
+            assert os.path.exists(
+                os.path.join(get_temp_path(), job_id, "upload_walls.csv")
+            )
+            progress = get_import_progress(r, job_id)
+            assert progress["status"] == "queued"
+            assert progress["filename"] == "upload_walls.csv"
+        finally:
+            remove(os.path.join(get_temp_path(), job_id))
+
+    @staticmethod
+    def test_post_when_unknown_model(
+        client, test_with_authenticated_user, add_investment, mocker
+    ):
+        mocker.patch("app.app_tasks.tasks.import_files.apply_async")
+        os.makedirs(get_temp_path(), exist_ok=True)
+        temp_files = os.listdir(get_temp_path())
+        data = {"file[]": (BytesIO(b"local_id;sector\n1;A\n"), "upload_walls.csv")}
+        response = client.post(
+            url_for("masonry_works.upload_files", model="users"),
+            data=data,
+            content_type="multipart/form-data",
+            follow_redirects=True,
+        )
+        assert b"Unknown kind of imported data." in response.data
+        import_files.apply_async.assert_not_called()
+        assert os.listdir(get_temp_path()) == temp_files
+
+
+class TestImportStatus:
+    @staticmethod
+    def test_get(client, test_with_authenticated_user, add_investment):
+        worker = Worker.query.filter_by(position="admin").first()
+        create_import_progress(r, "job", worker.id, "walls.csv")
+        response = client.get(url_for("masonry_works.import_status", job_id="job"))
+        assert response.status_code == 200
+        assert response.json["status"] == "queued"
+        assert response.json["rows"] == 0
+        assert response.json["messages"] == []
+
+    @staticmethod
+    def test_get_when_other_worker(
+        client, test_with_authenticated_user, add_investment
+    ):
+        create_import_progress(r, "job", 999, "walls.csv")
+        response = client.get(url_for("masonry_works.import_status", job_id="job"))
+        assert response.status_code == 404
+
+
+class TestExportWalls:
+    @staticmethod
+    def test_export_walls(add_walls):
+        items = Wall.query.order_by("local_id")
+        parts = list(export_walls(items, batch_size=2))
+        assert len(parts) == 3
+        lines = "".join(parts).splitlines()
+        assert lines[0].split(";")[:2] == ["local_id", "sector"]
+        assert lines[0].split(";")[-1] == "left_to_sale"
+        assert len(lines) == 1 + Wall.query.count()
+        wall = Wall.query.filter_by(local_id=1).first()
+        values = lines[1].split(";")
+        assert values[0] == "1"
+        assert float(values[-4]) == wall.gross_wall_area
+        assert float(values[-1]) == wall.left_to_sale
+
+    @staticmethod
+    def test_get(client, test_with_authenticated_user, add_walls):
+        response = client.get(url_for("masonry_works.export_walls_to_csv", sector="F"))
+        assert response.status_code == 200
+        assert response.mimetype == "text/csv"
+        assert "attachment" in response.headers["Content-Disposition"]
+        lines = response.get_data(as_text=True).splitlines()
+        assert len(lines) == 1 + Wall.query.filter_by(sector="F").count()
+        assert all(line.split(";")[1] == "F" for line in lines[1:])
+
+
+class TestSnapshot:
+    @staticmethod
+    def test_get_snapshot(add_walls):
+        investment = Investment.query.first()
+        frames = get_snapshot(investment.id)
+        assert len(frames["walls"]) == Wall.query.count()
+        assert len(frames["holes"]) == Hole.query.count()
+        assert len(frames["processing"]) == Processing.query.count()
+        assert str(frames["walls"]["local_id"].dtype) == "Int64"
+        assert str(frames["holes"]["amount"].dtype) == "Int64"
+        assert str(frames["processing"]["month"].dtype) == "string"
+        wall = Wall.query.filter_by(local_id=1).first()
+        assert frames["walls"].iloc[0]["gross_wall_area"] == wall.gross_wall_area
+        holes = Hole.query.join(Wall).order_by(Wall.local_id, Hole.id).all()
+        assert frames["holes"]["area"].tolist() == [hole.area for hole in holes]
+        assert frames["holes"]["total_area"].tolist() == [
+            hole.total_area for hole in holes
+        ]
+
+    @staticmethod
+    def test_round_trip(add_walls):
+        investment = Investment.query.first()
+
+        def get_state():
+            return [
+                (
+                    wall.local_id,
+                    wall.sector,
+                    wall._gross_wall_area,
+                    wall._wall_area_to_sale,
+                    wall._left_to_sale,
+                    [(hole.width, hole.amount) for hole in wall.get_holes()],
+                    [(item.month, item.done) for item in wall.get_processing()],
+                )
+                for wall in Wall.query.order_by(Wall.local_id)
+            ]
+
+        state = get_state()
+        filename = "snapshot_test.zip"
+        os.makedirs(get_temp_path(), exist_ok=True)
+        write_snapshot(
+            get_snapshot(investment.id), os.path.join(get_temp_path(), filename)
+        )
+        for wall in Wall.query.all():
+            Wall.delete_wall(wall.id)
+        messages = handle_snapshot(filename, investment.id, Wall)
+        assert messages[0] == "Walls: Uploaded {} items.".format(len(state))
+        assert not os.path.exists(os.path.join(get_temp_path(), filename))
+        # the overrun of done appended directly to wall 3 is limited on import
+        state[2][-1][1] = ("December", 0.4)
+        assert get_state() == state
+
+
+class TestCategories:
+    @staticmethod
+    def test_get_category(add_walls, wall_data):
+        investment = Investment.query.first()
+        other = Investment(name="Other Invest", description="test text")
+        db.session.add(other)
+        db.session.commit()
+        Wall.add_wall(**dict(wall_data, invest_id=other.id, sector="X"))
+        categories = Categories(investment.id)
+        assert categories.get_category("sector") == [None, "F", "G"]
+        assert categories.get_category("wall_width") == [None, 25]
+        assert r.exists(f"categories:{investment.id}")
+
+    @staticmethod
+    def test_cached_until_walls_change(add_walls, wall_data):
+        investment = Investment.query.first()
+        Categories(investment.id).get_category("sector")
+        Wall.query.update({"sector": "X"})
+        db.session.commit()
+        assert Categories(investment.id).get_category("sector") == [None, "F", "G"]
+        Wall.add_wall(**dict(wall_data, local_id=10, sector="A"))
+        assert not r.exists(f"categories:{investment.id}")
+        assert Categories(investment.id).get_category("sector") == [
+            None,
+            "A",
+            "F",
+            "G",
+        ]
+
+    @staticmethod
+    def test_not_invalidated_on_rollback(add_walls, wall_data):
+        investment = Investment.query.first()
+        Categories(investment.id).get_category("sector")
+        wall = Wall.query.first()
+        WallRollup.apply(investment.id, *wall.get_rollup_entry(), sign=-1)
+        db.session.rollback()
+        db.session.commit()
+        assert r.exists(f"categories:{investment.id}")
+
+
+class TestWallsPage:
+    @staticmethod
+    @pytest.mark.parametrize(
+        "sort, order",
+        [
+            ("local_id", "asc"),
+            ("sector", "asc"),
+            ("sector", "desc"),
+            ("gross_wall_area", "asc"),
+            ("gross_wall_area", "desc"),
+        ],
+    )
+    def test_pages_cover_sorted_walls(add_walls, sort, order):
+        # wall without the area sorts last in both directions
+        Wall.query.filter_by(local_id=2).update({"_gross_wall_area": None})
+        db.session.commit()
+        walls = Wall.query.all()
+        key = lambda wall: getattr(wall, getattr(Wall, sort).property.key)
+        expected = sorted(
+            [wall for wall in walls if key(wall) is not None],
+            key=lambda wall: (key(wall), wall.id),
+            reverse=order == "desc",
+        ) + [wall for wall in walls if key(wall) is None]
+        ids = []
+        after = None
+        while True:
+            page = WallsPage(Wall.query, sort, order, after, per_page=2)
+            ids += [wall.id for wall in page.items]
+            after = page.next_after
+            if after is None:
+                break
+        assert ids == [wall.id for wall in expected]
+
+    @staticmethod
+    def test_get(client, captured_templates, test_with_authenticated_user, add_walls):
+        url = url_for("masonry_works.walls", sort="sector", order="desc", sector="G")
+        response = client.get(url)
+        assert response.status_code == 200
+        template, context = captured_templates[0]
+        assert [wall.sector for wall in context["items"]] == ["G", "G", "G"]
+        assert context["args"] == {"sector": "G", "sort": "sector", "order": "desc"}
+        page = context["page"]
+        assert page.next_after is None
+        first = context["items"][0]
+        response = client.get(
+            url_for(
+                "masonry_works.walls",
+                sort="sector",
+                order="desc",
+                sector="G",
+                after=json.dumps(["G", first.id]),
+            )
+        )
+        template, context = captured_templates[1]
+        assert [wall.id for wall in context["items"]] == [
+            wall.id for wall in captured_templates[0][1]["items"][1:]
+        ]
+
+    @staticmethod
+    @pytest.mark.parametrize(
+        "sort, after",
+        [
+            ("local_id", "[[1], 5]"),
+            ("local_id", "[{}, 5]"),
+            ("sector", '["G", true]'),
+            ("local_id", "[1]"),
+            ("local_id", '["abc", 1]'),
+            ("local_id", "[1.5, 1]"),
+            ("local_id", "[true, 1]"),
+            ("sector", "[1.5, 1]"),
+            ("gross_wall_area", '["abc", 1]'),
+        ],
+    )
+    def test_get_with_wrong_after(
+        client, captured_templates, test_with_authenticated_user, add_walls, sort, after
+    ):
+        response = client.get(url_for("masonry_works.walls", sort=sort, after=after))
+        assert response.status_code == 200
+        template, context = captured_templates[0]
+        assert len(context["items"]) == Wall.query.count()
+
+    @staticmethod
+    def test_get_with_integer_after_of_float_column(
+        client, captured_templates, test_with_authenticated_user, add_walls
+    ):
+        url = url_for("masonry_works.walls", sort="gross_wall_area", after="[0, 0]")
+        response = client.get(url)
+        assert response.status_code == 200
+        template, context = captured_templates[0]
+        walls = Wall.query.filter(Wall.gross_wall_area > 0)
+        assert len(context["items"]) == walls.count()
+
+
+class TestApiWalls:
+    @staticmethod
+    def test_get(client, test_with_authenticated_user, add_walls):
+        url = url_for("masonry_works.api_walls", sector="F", sort="local_id")
+        response = client.get(url)
+        assert response.status_code == 200
+        data = response.get_json()
+        walls = Wall.query.filter_by(sector="F").order_by(Wall.local_id).all()
+        assert [wall["id"] for wall in data["walls"]] == [wall.id for wall in walls]
+        assert data["walls"][0]["gross_wall_area"] == walls[0].gross_wall_area
+        assert data["next_after"] is None
+        etag = response.headers["ETag"]
+
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        response = client.get(url_for("masonry_works.api_walls", sector="G"))
+        assert response.headers["ETag"] != etag
+
+        WallRollup.rebuild(walls[0].investment_id)
+        db.session.commit()
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+
+class TestMonthlyReport:
+    @staticmethod
+    def test_compute(add_walls):
+        investment = Investment.query.first()
+        wall = Wall.query.filter_by(local_id=1).first()
+        Wall.add_processing(wall_id=wall.id, year=2021, month="January", done=0.5)
+        report = MonthlyReport(investment.id)
+        expected = {}
+        for item in Processing.query.all():
+            key = (item.year, item.month, item.walls.sector, item.walls.brick_type)
+            sold = item.done * item.walls.wall_area_to_sale
+            expected[key] = expected.get(key, 0) + sold
+        assert [
+            (row["year"], row["month"], row["sector"], row["brick_type"])
+            for row in report.rows
+        ] == sorted(expected, key=lambda key: (key[0], key[2]))
+        for row in report.rows:
+            key = (row["year"], row["month"], row["sector"], row["brick_type"])
+            assert row["sold"] == pytest.approx(expected[key], abs=0.01)
+        january = report.rows[-1]
+        december = next(
+            row for row in report.rows[:-1] if row["sector"] == january["sector"]
+        )
+        assert january["cumulative_sold"] == pytest.approx(
+            december["sold"] + january["sold"], abs=0.02
+        )
+        to_sale = sum(
+            item.wall_area_to_sale
+            for item in Wall.query.filter_by(sector=january["sector"])
+        )
+        sold = sum(
+            value for key, value in expected.items() if key[2] == january["sector"]
+        )
+        assert january["progress"] == pytest.approx(sold / to_sale * 100, abs=0.01)
+        assert [(row["year"], row["month"]) for row in report.totals] == [
+            (2020, "December"),
+            (2021, "January"),
+        ]
+        assert report.totals[-1]["cumulative_sold"] == round(sum(expected.values()), 2)
+        assert r.exists(f"monthly_report:{investment.id}")
+
+    @staticmethod
+    def test_cached_until_processing_changes(add_walls):
+        investment = Investment.query.first()
+        MonthlyReport(investment.id).rows
+        Processing.query.update({"month": "November"})
+        db.session.commit()
+        assert MonthlyReport(investment.id).totals[0]["month"] == "December"
+        wall = Wall.query.filter_by(local_id=1).first()
+        Wall.add_processing(wall_id=wall.id, year=2021, month="1", done=0.5)
+        assert not r.exists(f"monthly_report:{investment.id}")
+        assert [row["month"] for row in MonthlyReport(investment.id).totals] == [
+            "November",
+            "1",
+        ]
+
+    @staticmethod
+    def test_get(client, captured_templates, test_with_authenticated_user, add_walls):
+        response = client.get(url_for("masonry_works.monthly_report"))
+        assert response.status_code == 200
+        template, context = captured_templates[0]
+        assert template.name == "production/masonry_works/monthly_report.html"
+        assert isinstance(context["report"], MonthlyReport)
+        assert b"December" in response.data
+
+
+class TestBenchmarks:
+    @staticmethod
+    def test_generate_data():
+        data = generate_data(50, seed=1)
+        assert data["walls"].equals(generate_data(50, seed=1)["walls"])
+        assert list(data["walls"]["local_id"]) == list(range(1, 51))
+        assert set(data["holes"]["wall_id"]) <= set(data["walls"]["local_id"])
+        assert data["processing"].groupby("wall_id")["done"].sum().max() <= 1
+
+    @staticmethod
+    def test_run_benchmarks(app_and_db):
+        report = run_benchmarks(app_and_db[0], sizes=[30], seed=1)
+        assert report["seed"] == 1
+        names = [result["benchmark"] for result in report["results"]]
+        assert names == [
+            "upload_walls",
+            "upload_holes",
+            "upload_processing",
+            "survey_hybrids",
+            "total_areas",
+            "categories",
+            "categories_cached",
+            "walls_view",
+            "walls_view_sorted",
+        ]
+        results = {result["benchmark"]: result for result in report["results"]}
+        assert all(result["walls"] == 30 for result in results.values())
+        assert results["total_areas"]["queries"] == 1
+        assert results["categories_cached"]["queries"] == 0
+        assert all(result["peak_memory"] > 0 for result in results.values())
+        json.dumps(report)
+
+    @staticmethod
+    @pytest.mark.parametrize(
+        "url, other, same",
+        [
+            ("redis://localhost:6379", "redis://localhost:6379/0", True),
+            ("redis://:password@redis:6379/0", "redis://redis/0", True),
+            ("redis://localhost:6379/15", "redis://localhost:6379/0", False),
+            ("redis://redis:6379/0", "redis://localhost:6379/0", False),
+            ("redis://localhost:6379/0", None, False),
+        ],
+    )
+    def test_is_same_redis(url, other, same):
+        assert is_same_redis(url, other) is same
+
+    @staticmethod
+    def test_benchmark_command_refuses_redis_of_app(app_and_db, mocker):
+        mocker.patch.dict(config, {"REDIS_URL": "redis://localhost:6379/0"})
+        run = mocker.patch("app.production.masonry_works.commands.run_benchmarks")
+        runner = app_and_db[0].test_cli_runner()
+        result = runner.invoke(
+            args=["masonry_works", "benchmark", "--redis-url", "redis://localhost"]
+        )
+        assert result.exit_code != 0
+        assert "--redis-url" in result.output
+        run.assert_not_called()
@@ -1,9 +1,14 @@
 import json
+from datetime import datetime
 from typing import *
+from uuid import uuid4
 
 from redis import Redis
 
-from app.app_tasks import tasks
+NOTIFICATIONS_KEEPALIVE = 15
+# inbox of worker keeps newest notifications only and expires when unused
+NOTIFICATIONS_LIMIT = 100
+NOTIFICATIONS_TTL = 7 * 24 * 60 * 60
 
 
 def create_notification(worker_id: int, n_type: str, description: str) -> Dict:
@@ -11,16 +16,226 @@ def create_notification(worker_id: int, n_type: str, description: str) -> Dict:
 
 
 def add_notification(r: Redis, notification: Dict) -> None:
+    """Queues notification for the worker and publishes it to notification
+    streams of the worker on the channel of the same name. The queue is the
+    backlog of notifications not yet delivered by any stream."""
+
     worker_id = notification.get("worker_id")
-    r.lpush(f"notifications:{worker_id}", json.dumps(notification))
+    key = f"notifications:{worker_id}"
+    payload = json.dumps(notification)
+    pipe = r.pipeline()
+    pipe.lpush(key, payload)
+    pipe.ltrim(key, 0, NOTIFICATIONS_LIMIT - 1)
+    pipe.expire(key, NOTIFICATIONS_TTL)
+    pipe.publish(key, payload)
+    pipe.execute()
+
+
+def drain_notifications(r: Redis, worker_id: int) -> List[Dict]:
+    """Pops all queued notifications of the worker, oldest first, in one
+    transaction, so notifications added meanwhile are neither lost nor read
+    twice."""
+
+    key = f"notifications:{worker_id}"
+    pipe = r.pipeline()
+    pipe.lrange(key, 0, -1)
+    pipe.delete(key)
+    notifications, _ = pipe.execute()
+    return [json.loads(notification) for notification in reversed(notifications)]
 
 
-def get_notification(r: Redis, worker_id: int) -> Dict:
+def stream_notifications(
+    r: Redis, worker_id: int, keepalive: float = NOTIFICATIONS_KEEPALIVE
+) -> Iterator[str]:
+    """Yields notifications of the worker as Server-Sent Events, starting with
+    the backlog drained on connect and then as they are published, so every
+    open stream of the worker receives each published notification. Once sent,
+    a notification is removed from the backlog. The stream is idle on the
+    pub/sub connection in between and sends a comment every keepalive seconds,
+    so closed connections are noticed."""
+
+    key = f"notifications:{worker_id}"
+    pubsub = r.pubsub()
+    pubsub.subscribe(key)
     try:
-        _, notification = r.blpop(f"notifications:{worker_id}", timeout=1)
-    except TypeError:
-        notification = b"{}"
-    return json.loads(notification)
+        drained = drain_notifications(r, worker_id)
+        for notification in drained:
+            yield f"data: {json.dumps(notification)}\n\n"
+        while True:
+            message = pubsub.get_message(timeout=keepalive)
+            if message is None:
+                drained = []
+                yield ": keepalive\n\n"
+            elif message["type"] == "message":
+                notification = json.loads(message["data"])
+                # published while the backlog was drained, so it has been sent
+                if notification in drained:
+                    drained.remove(notification)
+                    continue
+                yield f"data: {json.dumps(notification)}\n\n"
+                r.lrem(key, 1, message["data"])
+    finally:
+        pubsub.close()
+
+
+UNSEEN_TASKS_TTL = 60 * 60
+
+# counter is incremented only when it is cached, otherwise it is counted again
+# in the database on the next read
+INCREMENT_IF_EXISTS = """
+if redis.call("exists", KEYS[1]) == 1 then
+    return redis.call("incr", KEYS[1])
+end
+return nil
+"""
+
+
+def get_unseen_tasks(r: Redis, worker_id: int) -> Union[int, None]:
+    count = r.get(f"unseen_tasks:{worker_id}")
+    if count is not None:
+        return int(count)
+
+
+def cache_unseen_tasks(r: Redis, worker_id: int, count: int) -> None:
+    r.set(f"unseen_tasks:{worker_id}", count, ex=UNSEEN_TASKS_TTL, nx=True)
+
+
+def increment_unseen_tasks(r: Redis, worker_id: int) -> None:
+    r.eval(INCREMENT_IF_EXISTS, 1, f"unseen_tasks:{worker_id}")
+
+
+def reset_unseen_tasks(r: Redis, worker_id: int) -> None:
+    r.set(f"unseen_tasks:{worker_id}", 0, ex=UNSEEN_TASKS_TTL)
+
+
+def delete_unseen_tasks(r: Redis, worker_ids: Iterable) -> None:
+    keys = [f"unseen_tasks:{worker_id}" for worker_id in worker_ids if worker_id]
+    if keys:
+        r.delete(*keys)
+
+
+# field is removed only when it was not overwritten by a newer request since
+# it had been read, otherwise the newer activity waits for the next flush
+DELETE_IF_UNCHANGED = """
+local deleted = 0
+for i = 1, #ARGV, 2 do
+    if redis.call("hget", KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        deleted = deleted + redis.call("hdel", KEYS[1], ARGV[i])
+    end
+end
+return deleted
+"""
+
+
+def record_last_activity(r: Redis, user_id: int, timestamp: datetime) -> None:
+    r.hset("last_activity", user_id, timestamp.isoformat())
+
+
+def get_last_activity(r: Redis, user_id: int) -> Union[datetime, None]:
+    timestamp = r.hget("last_activity", user_id)
+    if timestamp is not None:
+        return datetime.fromisoformat(timestamp.decode("utf-8"))
+
+
+def delete_last_activity(r: Redis, user_id: int) -> None:
+    r.hdel("last_activity", user_id)
+
+
+def get_last_activities(r: Redis) -> Dict[int, str]:
+    return {
+        int(user_id): timestamp.decode("utf-8")
+        for user_id, timestamp in r.hgetall("last_activity").items()
+    }
+
+
+def delete_last_activities(r: Redis, activities: Dict[int, str]) -> None:
+    args = [arg for item in activities.items() for arg in item]
+    if args:
+        r.eval(DELETE_IF_UNCHANGED, 1, "last_activity", *args)
+
+
+IMPORT_PROGRESS_TTL = 24 * 60 * 60
+
+
+def create_import_progress(
+    r: Redis, job_id: str, worker_id: int, filename: str
+) -> None:
+    key = f"imports:{job_id}"
+    r.hset(
+        key,
+        mapping={
+            "worker_id": worker_id,
+            "filename": filename,
+            "status": "queued",
+            "rows": 0,
+            "failures": 0,
+            "messages": json.dumps([]),
+        },
+    )
+    r.expire(key, IMPORT_PROGRESS_TTL)
+
+
+def update_import_progress(r: Redis, job_id: str, **fields) -> None:
+    if "messages" in fields:
+        fields["messages"] = json.dumps(fields["messages"])
+    r.hset(f"imports:{job_id}", mapping=fields)
+
+
+def get_import_progress(r: Redis, job_id: str) -> Dict:
+    progress = {
+        key.decode("utf-8"): value.decode("utf-8")
+        for key, value in r.hgetall(f"imports:{job_id}").items()
+    }
+    for field in ["worker_id", "rows", "failures"]:
+        if field in progress:
+            progress[field] = int(progress[field])
+    if "messages" in progress:
+        progress["messages"] = json.loads(progress["messages"])
+    return progress
+
+
+def get_cached_categories(r: Redis, invest_id: int) -> Union[Dict, None]:
+    categories = r.get(f"categories:{invest_id}")
+    if categories is not None:
+        return json.loads(categories)
+
+
+def cache_categories(r: Redis, invest_id: int, categories: Dict) -> None:
+    r.set(f"categories:{invest_id}", json.dumps(categories))
+
+
+def delete_cached_categories(r: Redis, invest_ids: Iterable) -> None:
+    r.delete(*[f"categories:{invest_id}" for invest_id in invest_ids])
+
+
+def get_cached_report(r: Redis, invest_id: int) -> Union[Dict, None]:
+    report = r.get(f"monthly_report:{invest_id}")
+    if report is not None:
+        return json.loads(report)
+
+
+def cache_report(r: Redis, invest_id: int, report: Dict) -> None:
+    r.set(f"monthly_report:{invest_id}", json.dumps(report))
+
+
+def delete_cached_reports(r: Redis, invest_ids: Iterable) -> None:
+    r.delete(*[f"monthly_report:{invest_id}" for invest_id in invest_ids])
+
+
+def get_data_version(r: Redis, invest_id: int) -> str:
+    """Returns random token of the current version of walls data of investment,
+    so versions are not reused, e.g. after Redis is flushed."""
+
+    key = f"data_version:{invest_id}"
+    r.set(key, uuid4().hex, nx=True)
+    return r.get(key).decode("utf-8")
+
+
+def bump_data_versions(r: Redis, invest_ids: Iterable) -> None:
+    pipe = r.pipeline()
+    for invest_id in invest_ids:
+        pipe.set(f"data_version:{invest_id}", uuid4().hex)
+    pipe.execute()
 
 
 def populate_buffer(r: Redis) -> None:
@@ -36,6 +251,8 @@ def populate_buffer(r: Redis) -> None:
 
 
 def get_fake_name_from_buffer(r: Redis) -> str:
+    from app.app_tasks import tasks
+
     tasks.add_fake_name_to_buffer.delay()
     _, name = r.brpop(f"fake_names")
     return name.decode("utf-8")
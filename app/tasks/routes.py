@@ -4,7 +4,12 @@ from flask_login import login_required, current_user
 from app import db, r
 from app.main.forms import WarrantyForm
 from app.models import Task, Worker
-from app.redis_client import create_notification, add_notification
+from app.redis_client import (
+    create_notification,
+    add_notification,
+    delete_unseen_tasks,
+    increment_unseen_tasks,
+)
 from app.tasks import bp
 from app.tasks.forms import TaskForm, ProgressForm
 
@@ -15,8 +20,9 @@ def tasks():
     new_tasks = g.current_worker.get_new_tasks()
     if g.current_worker.id:
         g.current_worker.update_last_activity("last_time_tasks_displayed")
-    tasks_in_progress = Task.get_in_progress(invest_id=g.current_invest.id)
-    realized_tasks = Task.get_realized(invest_id=g.current_invest.id)
+    tasks_in_progress, realized_tasks = Task.get_board(
+        investment_id=g.current_invest.id
+    )
     admin = Worker.is_admin(user_id=current_user.id, investment_id=g.current_invest.id)
     next_page = url_for("tasks.tasks")
     return render_template(
@@ -33,26 +39,7 @@ def tasks():
 @bp.route("/my")
 @login_required
 def my_tasks():
-    # TODO wrap queries in functions
-
-    tasks_in_progress = (
-        Worker.get_by_username(
-            invest_id=g.current_invest.id, username=current_user.username
-        )
-        .tasks_to_execution.filter(Task.progress != 100)
-        .order_by(Task.deadline)
-        .order_by(Task.priority.desc())
-        .all()
-    )
-    realized_tasks = (
-        Worker.get_by_username(
-            invest_id=g.current_invest.id, username=current_user.username
-        )
-        .tasks_to_execution.filter(Task.progress == 100)
-        .order_by(Task.deadline)
-        .order_by(Task.priority.desc())
-        .all()
-    )
+    tasks_in_progress, realized_tasks = Task.get_board(executor_id=g.current_worker.id)
     admin = Worker.is_admin(user_id=current_user.id, investment_id=g.current_invest.id)
     next_page = url_for("tasks.my_tasks")
     return render_template(
@@ -68,26 +55,7 @@ def my_tasks():
 @bp.route("/deputed")
 @login_required
 def deputed_tasks():
-    # TODO wrap queries in functions
-
-    tasks_in_progress = (
-        Worker.get_by_username(
-            invest_id=g.current_invest.id, username=current_user.username
-        )
-        .deputed_tasks.filter(Task.progress != 100)
-        .order_by(Task.deadline)
-        .order_by(Task.priority.desc())
-        .all()
-    )
-    realized_tasks = (
-        Worker.get_by_username(
-            invest_id=g.current_invest.id, username=current_user.username
-        )
-        .deputed_tasks.filter(Task.progress == 100)
-        .order_by(Task.deadline)
-        .order_by(Task.priority.desc())
-        .all()
-    )
+    tasks_in_progress, realized_tasks = Task.get_board(orderer_id=g.current_worker.id)
     admin = Worker.is_admin(user_id=current_user.id, investment_id=g.current_invest.id)
     next_page = url_for("tasks.deputed_tasks")
     return render_template(
@@ -122,6 +90,7 @@ def add_task():
             )
         )
         db.session.commit()
+        increment_unseen_tasks(r, executor.id)
         flash("You have created the task successfully.")
         notification = create_notification(
             worker_id=executor.id,
@@ -147,11 +116,14 @@ def edit_task():
             task.description = form.description.data
             task.deadline = form.deadline.data
             task.priority = form.priority.data
+            executor_ids = [task.executor_id]
             if form.executor_name != task.executor.users.username:
                 task.executor = Worker.get_by_username(
                     invest_id=g.current_invest.id, username=form.executor_name.data
                 )
+                executor_ids.append(task.executor.id)
             db.session.commit()
+            delete_unseen_tasks(r, executor_ids)
             flash("You have edited the task successfully.")
             return redirect(next_page)
         elif request.method == "GET":
@@ -175,8 +147,12 @@ def delete_task():
         if form.no.data:
             flash("The task has not been deleted.")
         elif form.yes.data:
+            executor_ids = [
+                task.executor_id for task in Task.query.filter_by(id=_id).all()
+            ]
             Task.query.filter_by(id=_id).delete()
             db.session.commit()
+            delete_unseen_tasks(r, executor_ids)
             flash("You have deleted the task successfully.")
         return redirect(next_page)
     return render_template("warranty_form.html", title="Delete Task", form=form)
@@ -4,7 +4,9 @@ from flask import url_for
 from flask_login import current_user
 
 from app.main.forms import WarrantyForm
-from app.models import Task
+from app import r
+from app.models import Task, Worker
+from app.redis_client import get_unseen_tasks
 from app.tasks.forms import TaskForm, ProgressForm
 
 
@@ -26,7 +28,7 @@ class TestTasks:
         assert context["next_page"] == url_for("tasks.tasks")
 
 
-class MyTasks:
+class TestMyTasks:
     @staticmethod
     def test_get(client, captured_templates, test_with_authenticated_user, add_tasks):
         task2 = Task.query.filter_by(description="test task 2").first()
@@ -43,7 +45,7 @@ class MyTasks:
         assert context["next_page"] == url_for("tasks.my_tasks")
 
 
-class DeputedTasks:
+class TestDeputedTasks:
     @staticmethod
     def test_get(client, captured_templates, test_with_authenticated_user, add_tasks):
         task1 = Task.query.filter_by(description="test task 1").first()
@@ -91,6 +93,21 @@ class TestAddTask:
         assert b"You have created the task successfully." in response.data
         assert Task.query.filter_by(description="test task").first()
 
+    @staticmethod
+    def test_post_increments_unseen_tasks(
+        client, test_with_authenticated_user, add_investment
+    ):
+        executor = Worker.query.filter_by(position="second worker").first()
+        assert executor.count_new_tasks() == 0
+        form = TaskForm(
+            description="test task",
+            deadline=date.today() + timedelta(days=2),
+            priority=5,
+            executor_name="unlogged_user",
+        )
+        client.post(url_for("tasks.add_task"), data=form.data)
+        assert get_unseen_tasks(r, executor.id) == 1
+
     @staticmethod
     def test_post_when_no_orderer(
         client, captured_templates, test_with_authenticated_user, add_investment
@@ -1,18 +1,193 @@
-from app.conftest import contexts_required
-from app.handling_files import read_csv_file, read_csv_files
+from typing import *
 
+import pandas as pd
+import pytest
+from billiard import Pool
+from wtforms.validators import ValidationError
 
-@contexts_required
-def test_read_file():
-    file = read_csv_file("test/walls.csv")
-    assert type(file) == list
+from app.handling_files import (
+    LOCAL_ID_FIELDS,
+    handle_csv_files,
+    parse_csv_chunks,
+    parse_csv_chunks_in_pool,
+    parse_frame,
+    read_csv_frames,
+)
+from app.models import Hole, Investment, Wall
+from app.validators import (
+    check_field_exists,
+    convert_column,
+    validate_holes,
+    validate_processing,
+    validate_processing_frame,
+    validate_walls,
+)
+from config import config
 
+ROW_VALIDATORS = {
+    "walls": validate_walls,
+    "holes": validate_holes,
+    "processing": validate_processing,
+}
 
-@contexts_required
-def test_read_files():
-    files = read_csv_files("test")
-    for file in files:
-        assert type(file) == list
+
+def parse_records(records: List, model: str) -> List:
+    """Parses records one by one with row validators, as parse_frame should."""
+
+    rows = []
+    for data in records:
+        local_id = check_field_exists(data, LOCAL_ID_FIELDS[model])
+        try:
+            data = ROW_VALIDATORS[model](data) if local_id else None
+        except ValidationError:
+            data = None
+        rows.append((local_id, data))
+    return rows
+
+
+def test_read_csv_frames(temp_csv):
+    filename = temp_csv("chunks.csv", [{"local_id": i} for i in range(5)])
+    frames = list(read_csv_frames(filename, chunksize=2))
+    assert [len(frame) for frame in frames] == [2, 2, 1]
+    assert frames[2].to_dict(orient="records") == [{"local_id": 4}]
+
+
+def test_parse_csv_chunks(temp_csv):
+    columns = ["wall_id", "width", "height", "amount"]
+    rows = [[1, 1, 2, 1], ["x", 1, 2, 1], [2, "x", 2, 1]]
+    filename = temp_csv("parse.csv", [dict(zip(columns, row)) for row in rows])
+    chunks = list(parse_csv_chunks(filename, "holes", chunksize=2))
+    assert chunks == [
+        [(1, {"wall_id": 1, "width": 1.0, "height": 2.0, "amount": 1}), (None, None)],
+        [(2, None)],
+    ]
+
+
+def test_parse_csv_chunks_in_pool(temp_csv):
+    columns = ["wall_id", "width", "height", "amount"]
+    rows = [[i, 1, 2, 1] if i % 3 else [i, "x", 2, 1] for i in range(1, 11)]
+    filename = temp_csv("parse.csv", [dict(zip(columns, row)) for row in rows])
+    pool = Pool(2)
+    try:
+        chunks = parse_csv_chunks_in_pool(pool, filename, "holes", 2, chunksize=3)
+        assert list(chunks) == list(parse_csv_chunks(filename, "holes", chunksize=3))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+@pytest.mark.parametrize(
+    "model, columns, rows",
+    [
+        (
+            "walls",
+            [
+                "local_id",
+                "sector",
+                "wall_width",
+                "wall_length",
+                "floor_ord",
+                "ceiling_ord",
+            ],
+            [
+                [1, "G", 25, 10.5, 0, 3.1],
+                [2, "G", 25.7, "10", "-1", 3],
+                [3, "G", "", 10.5, 0, 3.1],
+                [4, "G", 25, "x", 0, 3.1],
+                [5, "G", 25, 10.5, "", 3.1],
+                ["", "G", 25, 10.5, 0, 3.1],
+                [0, "G", 25, 10.5, 0, 3.1],
+                ["6.9", "G", "inf", 10.5, 0, "inf"],
+                [1e19, "G", 25, 10.5, 0, 3.1],
+            ],
+        ),
+        (
+            "holes",
+            ["wall_id", "width", "height", "amount"],
+            [
+                [1, 1, 2, 1],
+                [1, "", 2, 1],
+                [2, 1.5, "nan", 2],
+                [3, 1, 2, 1.5],
+                ["x", 1, 2, 1],
+            ],
+        ),
+        (
+            "processing",
+            ["wall_id", "year", "month", "done"],
+            [
+                [1, 2020, "May", 0.5],
+                [1, 0, "May", 0.5],
+                [2, 2020, "", 0.5],
+                [3, 2020, 12, -0.1],
+                [4, "", "May", 0.2],
+                [5, 2021, "June", ""],
+                [6, 2021, "June", "x"],
+            ],
+        ),
+    ],
+)
+def test_parse_frame_matches_parse_records(temp_csv, model, columns, rows):
+    filename = temp_csv("parse_frame.csv", [dict(zip(columns, row)) for row in rows])
+    for chunksize in [1, 3, 100]:
+        for frame in read_csv_frames(filename, chunksize):
+            expected = parse_records(frame.to_dict(orient="records"), model)
+            assert parse_frame(frame, model) == expected
+
+
+@pytest.mark.parametrize("values", [[1.5, float("nan")], [1.5, float("inf"), 1e19]])
+def test_convert_column_matches_int(values):
+    frame = pd.DataFrame({"field": values})
+    converted, bad = convert_column(frame, "field", int)
+    for value, number, is_bad in zip(values, converted, bad):
+        try:
+            assert number == int(value) and not is_bad
+        except (ValueError, OverflowError):
+            assert is_bad
+
+
+def test_validate_frame_reasons():
+    frame = pd.DataFrame(
+        {
+            "year": [2020, 0, 2020, 2020],
+            "month": ["May", "May", None, "May"],
+            "done": [0.5, 0.5, 0.5, -1],
+        }
+    )
+    frame, reasons = validate_processing_frame(frame)
+    assert reasons.notna().tolist() == [False, True, True, True]
+    assert reasons.tolist()[1:] == [
+        "Value of 'year' can not be '0' or 'None'!",
+        "Value of 'month' can not be 'NaN'!",
+        "done values must be greater than 0!",
+    ]
+
+
+def test_handle_csv_files(add_walls, temp_csv, mocker):
+    mocker.patch.dict(config, {"IMPORT_PROCESSES": 2, "CSV_CHUNK_SIZE": 1})
+    investment = Investment.query.first()
+    columns = ["wall_id", "width", "height", "amount"]
+    filenames = [
+        temp_csv("holes_1.csv", [dict(zip(columns, [1, 1, 2, 1]))]),
+        "missing.csv",
+        temp_csv(
+            "holes_2.csv",
+            [dict(zip(columns, row)) for row in [[2, 1, 1, 3], [2, "x", 1, 1]]],
+        ),
+    ]
+    reports = []
+    messages = handle_csv_files(
+        filenames, investment.id, "holes", Wall, lambda *report: reports.append(report)
+    )
+    assert messages[0] == "Uploaded 1 items."
+    assert messages[1].startswith("An error occurred")
+    assert messages[2:] == [
+        "Uploaded 1 items.",
+        "Items: [2] not added because they has the wrong format.",
+    ]
+    assert reports == [(1, 0), (2, 0), (3, 1)]
+    wall = Wall.query.filter_by(local_id=2).first()
+    assert [hole.amount for hole in Hole.get_items_by_wall_id(wall.id)] == [3]
 
 
 def test_get_current_and_prev_path(app_and_db):
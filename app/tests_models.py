@@ -1,7 +1,29 @@
+import random
+from fractions import Fraction
+
 import pytest
+from sqlalchemy import event
 
+from app import db, r
 from app.conftest import contexts_required
-from app.models import Hole, Processing, Wall, User, Investment, Worker, Task
+from app.decimals import exact, multiply, subtract
+from app.models import (
+    Hole,
+    Processing,
+    Wall,
+    WallRollup,
+    User,
+    Investment,
+    Worker,
+    Task,
+)
+from app.redis_client import (
+    delete_unseen_tasks,
+    get_last_activity,
+    get_unseen_tasks,
+    increment_unseen_tasks,
+)
+from config import config
 
 
 class TestMasonryWorks:
@@ -250,6 +272,55 @@ class TestMasonryWorks:
         )
         assert Wall.query.filter_by(id=1).first().wall_width == 18
 
+    @staticmethod
+    @pytest.mark.parametrize("chunk_size", [1, 1000])
+    def test_upload_walls_upserts_by_local_id(add_walls, temp_csv, mocker, chunk_size):
+        mocker.patch.dict(config, {"CSV_CHUNK_SIZE": chunk_size})
+        investment = Investment.query.first()
+        columns = ["local_id", "sector", "wall_width", "wall_length", "ceiling_ord"]
+        rows = [
+            dict(zip(columns, [1, "A", 18, 2, 3])),
+            dict(zip(columns, [6, "A", 18, 4, 3])),
+            dict(zip(columns, [7, "A", 18, "x", 3])),
+            dict(zip(columns, [6, "B", 24, 5, 3])),
+        ]
+        filename = temp_csv(
+            "walls_upsert.csv", [dict(row, floor_ord=0) for row in rows]
+        )
+        messages = Wall.upload_walls(investment.id, filename)
+        assert messages == [
+            "Uploaded 3 items.",
+            "Items: [7] not added because they has the wrong format.",
+        ]
+        assert Wall.query.count() == 6
+        wall = Wall.query.filter_by(local_id=1).first()
+        assert wall.sector == "A"
+        assert wall.brick_type == "YTONG"
+        assert wall._gross_wall_area == 6
+        wall = Wall.query.filter_by(local_id=6).first()
+        assert wall.sector == "B"
+        assert wall.wall_width == 24
+        assert wall.investment_id == investment.id
+        assert wall._gross_wall_area == 15
+        assert WallRollup.query.filter_by(sector="B").first().gross_wall_area == 1500
+
+    @staticmethod
+    def test_upload_walls_when_batch_fails(add_walls, temp_csv, mocker):
+        investment = Investment.query.first()
+        columns = ["local_id", "wall_width", "wall_length", "floor_ord", "ceiling_ord"]
+        rows = [
+            dict(zip(columns, [1, 18, 2, 0, 3])),
+            dict(zip(columns, [8, 18, 4, 0, 3])),
+        ]
+        filename = temp_csv("walls_upsert.csv", rows)
+        mocker.patch.object(
+            db.session, "bulk_insert_mappings", side_effect=Exception("batch")
+        )
+        messages = Wall.upload_walls(investment.id, filename)
+        assert messages == ["Uploaded 2 items."]
+        assert Wall.query.filter_by(local_id=1).first()._gross_wall_area == 6
+        assert Wall.query.filter_by(local_id=8).first()._gross_wall_area == 12
+
     @staticmethod
     @contexts_required
     def test_upload_walls_when_wrong_file(app_and_db, add_investment):
@@ -278,6 +349,65 @@ class TestMasonryWorks:
             == "Items: [6, 7, 12, 13, 14, 15, 16, 17] not added because wall with specified id does not exist. Add wall first."
         )
 
+    @staticmethod
+    @pytest.mark.parametrize("chunk_size", [1, 1000])
+    def test_upload_holes_replaces_holes_of_walls(
+        add_walls, temp_csv, mocker, chunk_size
+    ):
+        mocker.patch.dict(config, {"CSV_CHUNK_SIZE": chunk_size})
+        investment = Investment.query.first()
+        wall = Wall.query.filter_by(local_id=1).first()
+        other_holes = Hole.query.filter(Hole.wall_id != wall.id).count()
+        columns = ["wall_id", "width", "height", "amount"]
+        rows = [
+            dict(zip(columns, [1, 1, 2, 1])),
+            dict(zip(columns, [1, 1, "x", 1])),
+            dict(zip(columns, [1, 2, 2, 2])),
+            dict(zip(columns, [9, 1, 2, 1])),
+        ]
+        filename = temp_csv("holes_upload.csv", rows)
+        messages = Wall.upload_holes(investment.id, filename)
+        assert messages == [
+            "Uploaded 2 items.",
+            "Items: [1] not added because they has the wrong format.",
+            "Items: [9] not added because wall with specified id does not exist. Add wall first.",
+        ]
+        holes = Hole.get_items_by_wall_id(wall.id)
+        assert [(hole.width, hole.amount) for hole in holes] == [(1, 1), (2, 2)]
+        assert Hole.query.filter(Hole.wall_id != wall.id).count() == other_holes
+        wall = Wall.query.filter_by(local_id=1).first()
+        assert wall._wall_area_to_survey == round(wall.gross_wall_area - 10, 2)
+
+    @staticmethod
+    @pytest.mark.parametrize("chunk_size", [1, 1000])
+    def test_upload_processing_limits_done_to_left_to_sale(
+        add_walls, temp_csv, mocker, chunk_size
+    ):
+        mocker.patch.dict(config, {"CSV_CHUNK_SIZE": chunk_size})
+        investment = Investment.query.first()
+        wall = Wall.query.filter_by(local_id=1).first()
+        columns = ["wall_id", "year", "month", "done"]
+        rows = [
+            dict(zip(columns, [1, 2021, "January", 0.6])),
+            dict(zip(columns, [1, 2021, "February", -0.1])),
+            dict(zip(columns, [1, 2021, "March", 0.7])),
+            dict(zip(columns, [1, 2021, "April", 0.1])),
+            dict(zip(columns, [2, 2021, "January", 0.25])),
+            dict(zip(columns, [9, 2021, "January", 0.1])),
+        ]
+        filename = temp_csv("processing_upload.csv", rows)
+        messages = Wall.upload_processing(investment.id, filename)
+        assert messages == [
+            "Uploaded 3 items.",
+            "Items: [1] not added because they has the wrong format.",
+            "Items: [9] not added because wall with specified id does not exist. Add wall first.",
+            "Items: [1] not added because value of left_to_sale is 0.",
+        ]
+        processing = Processing.get_items_by_wall_id(wall.id)
+        assert [item.done for item in processing] == [0.6, 0.4]
+        assert Wall.query.filter_by(local_id=1).first()._left_to_sale == 0
+        assert Wall.query.filter_by(local_id=2).first()._left_to_sale == 0.75
+
     @staticmethod
     @contexts_required
     def test_upload_processing(app_and_db, add_investment):
@@ -300,8 +430,108 @@ class TestMasonryWorks:
             messages[3] == "Items: [1, 3] not added because value of left_to_sale is 0."
         )
 
+    @staticmethod
+    def test_prefetch(app_and_db, add_walls):
+        db = app_and_db[1]
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        walls = Wall.prefetch(Wall.query.order_by(Wall.local_id))
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            areas = [
+                (wall.wall_area_to_survey, wall.wall_area_to_sale, wall.left_to_sale)
+                for wall in walls
+            ]
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        assert not statements
+        db.session.expire_all()
+        assert areas == [
+            (wall.wall_area_to_survey, wall.wall_area_to_sale, wall.left_to_sale)
+            for wall in walls
+        ]
+
+    @staticmethod
+    def test_refresh_metrics(app_and_db, add_walls):
+        db = app_and_db[1]
+        walls = Wall.query.order_by(Wall.id).all()
+        for wall in walls:
+            wall.update_metrics(rollup=False)
+        expected = [
+            (wall.wall_height, wall.gross_wall_area, wall.left_to_sale)
+            for wall in walls
+        ]
+        db.session.rollback()
+        Wall.query.update({"_gross_wall_area": None, "_left_to_sale": None})
+        db.session.commit()
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            Wall.refresh_metrics(wall.id for wall in walls)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        updates = [s for s in statements if s.startswith("UPDATE walls")]
+        assert len(updates) == 1
+        assert [
+            (wall.wall_height, wall.gross_wall_area, wall.left_to_sale)
+            for wall in Wall.query.order_by(Wall.id)
+        ] == expected
+
+    @staticmethod
+    def test_prefetch_cleared_on_commit(add_wall):
+        wall = Wall.prefetch(Wall.query)[0]
+        assert wall.wall_area_to_survey == 32.55
+        Wall.add_hole(wall.id, width=1.2, height=2.25, amount=2)
+        assert wall.wall_area_to_survey == 27.15
+
+
+class TestDecimals:
+    @staticmethod
+    def test_matches_fraction_arithmetic():
+        random.seed(0)
+        for _ in range(10000):
+            length, floor, ceiling = [
+                round(random.uniform(-20, 20), random.randint(0, 6)) for _ in range(3)
+            ]
+            expected = Fraction(str(length)) * (
+                Fraction(str(ceiling)) - Fraction(str(floor))
+            )
+            result = multiply(exact(length), subtract(exact(ceiling), exact(floor)))
+            assert round(float(result), 2) == round(float(expected), 2)
+
+    @staticmethod
+    @pytest.mark.parametrize("value", [None, "", "abc", float("nan"), float("inf")])
+    def test_invalid_value(value):
+        with pytest.raises(ValueError):
+            exact(value)
+
 
 class TestWorker:
+    @staticmethod
+    def test_count_new_tasks(add_tasks):
+        worker = Worker.query.filter_by(position="admin").first()
+        assert worker.count_new_tasks() == len(worker.get_new_tasks()) == 2
+        assert get_unseen_tasks(r, worker.id) == 2
+        Task.query.filter_by(executor_id=worker.id).delete()
+        db.session.commit()
+        assert worker.count_new_tasks() == 2
+        increment_unseen_tasks(r, worker.id)
+        assert worker.count_unseen_notifications(n_type="tasks") == 3
+        worker.update_last_activity("last_time_tasks_displayed")
+        assert worker.count_new_tasks() == 0
+        delete_unseen_tasks(r, [worker.id])
+        increment_unseen_tasks(r, worker.id)
+        assert get_unseen_tasks(r, worker.id) is None
+        assert worker.count_new_tasks() == 0
+        assert Worker().count_new_tasks() == 0
+
     @staticmethod
     def test_belongs_to_investment(app_and_db, active_user):
         db = app_and_db[1]
@@ -456,6 +686,17 @@ class TestInvestment:
 
 
 class TestUser:
+    @staticmethod
+    def test_update_last_activity(app_and_db, active_user):
+        user = User.query.filter_by(username="active_user").first()
+        last_activity = user.last_activity
+        assert user.get_last_activity() == last_activity
+        user.update_last_activity()
+        assert not db.session.dirty
+        assert user.last_activity == last_activity
+        assert user.get_last_activity() == get_last_activity(r, user.id)
+        assert user.get_last_activity() > last_activity
+
     @staticmethod
     def test_user(app_and_db):
         db = app_and_db[1]
@@ -590,3 +831,36 @@ class TestTask:
         assert worker2.deputed_tasks.all() == []
         assert worker2.tasks_to_execution.all() == [task1]
         assert investment.tasks.all() == [task1, task2, task3]
+
+    @staticmethod
+    def test_get_board(add_tasks):
+        investment = Investment.query.first()
+        worker1 = Worker.query.filter_by(position="admin").first()
+        task1 = Task.query.filter_by(description="test task 1").first()
+        task2 = Task.query.filter_by(description="test task 2").first()
+        task3 = Task.query.filter_by(description="test task 3").first()
+        db.session.expunge_all()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            in_progress, realized = Task.get_board(investment_id=investment.id)
+            usernames = [
+                (task.orderer.users.username, task.executor.users.username)
+                for task in in_progress + realized
+            ]
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        assert len(statements) == 1
+        assert [task.id for task in in_progress] == [task1.id, task2.id]
+        assert [task.id for task in realized] == [task3.id]
+        assert usernames[0] == ("active_user", "unlogged_user")
+
+        in_progress, realized = Task.get_board(executor_id=worker1.id)
+        assert [task.id for task in in_progress] == [task2.id]
+        assert [task.id for task in realized] == [task3.id]
+        assert Task.get_board(executor_id=None) == ([], [])
@@ -1,9 +1,11 @@
-from fractions import Fraction as frac
 from typing import *
 
+import numpy as np
+import pandas as pd
 from wtforms.validators import ValidationError
 
 from app import db
+from app.decimals import add, exact
 
 
 def is_nan(x):
@@ -11,7 +13,7 @@ def is_nan(x):
 
 
 def validate_walls(data: Dict) -> Dict:
-    """ Validates values from inputted Dict and returns it when no ValidationError occurs. """
+    """Validates values from inputted Dict and returns it when no ValidationError occurs."""
 
     data = check_field_type(data, "wall_width", int)
     for field in ["wall_length", "floor_ord", "ceiling_ord"]:
@@ -28,7 +30,7 @@ def validate_holes(data: Dict) -> Dict:
     return data
 
 
-def validate_processing(wall: db.Model, data: Dict) -> Dict:
+def validate_processing(data: Dict, left_to_sale: float = None) -> Dict:
     data = check_field_type(data, "year", int)
     data = check_field_type(data, "month", str)
     data = check_field_type(data, "done", float)
@@ -39,14 +41,15 @@ def validate_processing(wall: db.Model, data: Dict) -> Dict:
     check_not_nan(data["done"])
     if data["done"] < 0:
         raise ValidationError("done values must be greater than 0!")
-    data = validate_done_attr_while_adding(wall, data)
+    if left_to_sale is not None:
+        data = limit_done(data, left_to_sale)
     return data
 
 
 def check_field_type(data: Dict, field: str, field_type: Type) -> Dict:
     try:
         value = field_type(data.get(field, None))
-    except (ValueError, TypeError):
+    except (ValueError, TypeError, OverflowError):
         raise ValidationError(
             "Value of '{}' must be '{}'!".format(field, field_type.__name__)
         )
@@ -69,21 +72,141 @@ def check_field_exists(data: Dict, field: str) -> Any:
         return data[field]
 
 
-def validate_done_attr_while_adding(wall: db.Model, data: Dict) -> Dict:
+def validate_walls_frame(frame: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+    """Validates whole chunk of walls at once, accepting and rejecting rows as
+    validate_walls does. Returns frame with converted values and reasons of
+    rejection, which are missing for valid rows, so mask of bad rows is
+    reasons.notna()."""
+
+    frame = frame.copy()
+    reasons = pd.Series(None, index=frame.index, dtype=object)
+    check_column_type(frame, reasons, "wall_width", int)
+    for field in ["wall_length", "floor_ord", "ceiling_ord"]:
+        check_column_type(frame, reasons, field, float)
+        check_column_not_nan(frame, reasons, field)
+    return frame, reasons
+
+
+def validate_holes_frame(frame: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+    frame = frame.copy()
+    reasons = pd.Series(None, index=frame.index, dtype=object)
+    for field in ["width", "height"]:
+        check_column_type(frame, reasons, field, float)
+        check_column_not_nan(frame, reasons, field)
+    check_column_type(frame, reasons, "amount", int)
+    return frame, reasons
+
+
+def validate_processing_frame(
+    frame: pd.DataFrame,
+) -> Tuple[pd.DataFrame, pd.Series]:
+    frame = frame.copy()
+    reasons = pd.Series(None, index=frame.index, dtype=object)
+    check_column_type(frame, reasons, "year", int)
+    check_column_type(frame, reasons, "month", str)
+    check_column_type(frame, reasons, "done", float)
+    add_reason(reasons, frame["year"] == 0, "Value of 'year' can not be '0' or 'None'!")
+    add_reason(reasons, frame["month"] == "nan", "Value of 'month' can not be 'NaN'!")
+    check_column_not_nan(frame, reasons, "done")
+    add_reason(reasons, frame["done"] < 0, "done values must be greater than 0!")
+    return frame, reasons
+
+
+# floats from this bound on do not fit in int64
+INT64_BOUND = -float(np.iinfo(np.int64).min)
+
+
+def convert_column(
+    frame: pd.DataFrame, field: str, field_type: Type
+) -> Tuple[pd.Series, pd.Series]:
+    """Converts column of frame as field_type(value) converts single values and
+    returns converted column with mask of values which cannot be converted.
+    Numeric columns are converted at once. Other columns, and float columns
+    with values out of range of int64 converted to int, are converted value by
+    value."""
+
+    if field not in frame:
+        values = pd.Series(None, index=frame.index, dtype=object)
+    else:
+        values = frame[field]
+    no_errors = pd.Series(False, index=frame.index)
+    if field_type is not str and pd.api.types.is_numeric_dtype(values):
+        if field_type is float and pd.api.types.is_float_dtype(values):
+            return values.astype("float64"), no_errors
+        if field_type is int and pd.api.types.is_float_dtype(values):
+            numbers = values.astype("float64").to_numpy()
+            bad = ~np.isfinite(numbers)
+            if not (np.abs(numbers[~bad]) >= INT64_BOUND).any():
+                numbers = np.trunc(np.where(bad, 0, numbers)).astype(np.int64)
+                return pd.Series(numbers, index=frame.index), pd.Series(
+                    bad, index=frame.index
+                )
+        else:
+            bad = values.isna()
+            numbers = values.where(~bad, 0).astype(
+                "int64" if field_type is int else "float64"
+            )
+            return numbers, bad
+
+    converted = []
+    bad = []
+    missing = np.nan if field_type is float else None
+    for value in values.astype(object).tolist():
+        try:
+            converted.append(field_type(value))
+            bad.append(False)
+        except (ValueError, TypeError, OverflowError):
+            converted.append(missing)
+            bad.append(True)
+    return (
+        pd.Series(
+            converted,
+            index=frame.index,
+            dtype="float64" if field_type is float else object,
+        ),
+        pd.Series(bad, index=frame.index),
+    )
+
+
+def check_column_type(
+    frame: pd.DataFrame, reasons: pd.Series, field: str, field_type: Type
+) -> None:
+    frame[field], bad = convert_column(frame, field, field_type)
+    add_reason(
+        reasons, bad, "Value of '{}' must be '{}'!".format(field, field_type.__name__)
+    )
+
+
+def check_column_not_nan(frame: pd.DataFrame, reasons: pd.Series, field: str) -> None:
+    add_reason(
+        reasons, frame[field].isna(), "Value of '{}' can not be 'NaN'!".format(field)
+    )
+
+
+def add_reason(reasons: pd.Series, bad: pd.Series, reason: str) -> None:
+    """Sets reason of rows which are bad and have not been rejected yet."""
+
+    reasons[bad.fillna(False).astype(bool) & reasons.isna()] = reason
+
+
+def limit_done(data: Dict, left_to_sale: float) -> Dict:
     done = data.get("done")
     if done:
-        if float(wall.left_to_sale) < float(done):
-            data["done"] = float(wall.left_to_sale)
+        if float(left_to_sale) < float(done):
+            data["done"] = float(left_to_sale)
     return data
 
 
+def validate_done_attr_while_adding(wall: db.Model, data: Dict) -> Dict:
+    return limit_done(data, wall.left_to_sale)
+
+
 def validate_done_attr_while_editing(
     wall: db.Model, processing: db.Model, data: Dict
 ) -> Dict:
     done = data.get("done")
     if done:
-        left_to_sale = frac(str(wall.left_to_sale))
-        left_to_sale += frac(str(processing.done))
+        left_to_sale = add(exact(wall.left_to_sale), exact(processing.done))
         if float(left_to_sale) < float(done):
             data["done"] = float(left_to_sale)
     return data
@@ -22,9 +22,13 @@ config = {
     # Upload settings
     "UPLOAD_FOLDER": "app/static/files",
     "ALLOWED_EXTENSIONS": {"csv", "pdf"},
+    "CSV_CHUNK_SIZE": 1000,
+    # number of processes parsing uploaded files of one import job, each
+    # concurrent import starts its own, files are parsed by the job itself if 1
+    "IMPORT_PROCESSES": int(os.environ.get("IMPORT_PROCESSES", 2)),
     # Celery settings
     "broker_url": os.environ.get("REDIS_URL"),
     "result_backend": os.environ.get("REDIS_URL"),
     # Redis settings
-    "REDIS_URL": os.environ.get("REDIS_URL")
+    "REDIS_URL": os.environ.get("REDIS_URL"),
 }
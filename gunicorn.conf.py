@@ -0,0 +1,9 @@
+def post_fork(server, worker):
+    """Makes psycopg2 cooperative in gevent workers, so a request waiting for the
+    database yields to other greenlets, e.g. notification streams, instead of
+    blocking the whole worker."""
+
+    if server.cfg.worker_class_str == "gevent":
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()